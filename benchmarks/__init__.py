@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic books and timings for measuring how rendering and extraction
+scale.
+
+These are development tools kept beside the package rather than
+installed with it; run them from a checkout, for example with
+``python -m benchmarks.suite``, and their tests with
+``tox -e benchmarks``.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
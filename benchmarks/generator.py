@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generates LaTeX books of arbitrary size that use every kind of
+assessment this package renders.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import random
+
+from collections import Counter
+
+logger = __import__('logging').getLogger(__name__)
+
+#: ``(environment, template)`` for a question part of each kind.
+#: Templates are filled in with ``%`` formatting.
+PART_TEMPLATES = (
+    ('naqsymmathpart', r"""
+    \begin{naqsymmathpart}
+    Simplify the expression %(n)s.
+    \begin{naqsolutions}
+        \naqsolution $\frac{%(n)s}{8}$
+    \end{naqsolutions}
+    \begin{naqhints}
+        \naqhint Reduce the fraction.
+    \end{naqhints}
+    \end{naqsymmathpart}"""),
+    ('naqnumericmathpart', r"""
+    \begin{naqnumericmathpart}
+    What is %(n)s times two?
+    \begin{naqsolutions}
+        \naqsolution $%(double)s$
+    \end{naqsolutions}
+    \end{naqnumericmathpart}"""),
+    ('naqfreeresponsepart', r"""
+    \begin{naqfreeresponsepart}
+    Name the item numbered %(n)s.
+    \begin{naqsolutions}
+        \naqsolution Item %(n)s
+    \end{naqsolutions}
+    \end{naqfreeresponsepart}"""),
+    ('naqmodeledcontentpart', r"""
+    \begin{naqmodeledcontentpart}
+    Sketch the figure for item %(n)s.
+    \end{naqmodeledcontentpart}"""),
+    ('naqessaypart', r"""
+    \begin{naqessaypart}
+    Discuss item %(n)s at length.
+    \begin{naqhints}
+        \naqhint Use examples.
+    \end{naqhints}
+    \end{naqessaypart}"""),
+    ('naqmultiplechoicepart', r"""
+    \begin{naqmultiplechoicepart}
+    Which choice is right for item %(n)s?
+    \begin{naqchoices}
+        \naqchoice This one is not.
+        \naqchoice[1] This one is.
+        \naqchoice[0.5] This one is half right.
+    \end{naqchoices}
+    \begin{naqsolexplanation}
+        Only the second choice is right.
+    \end{naqsolexplanation}
+    \end{naqmultiplechoicepart}"""),
+    ('naqmultiplechoicemultipleanswerpart', r"""
+    \begin{naqmultiplechoicemultipleanswerpart}
+    Which choices are right for item %(n)s?
+    \begin{naqchoices}
+        \naqchoice This one is not.
+        \naqchoice[1] This one is.
+        \naqchoice[1] So is this one.
+    \end{naqchoices}
+    \end{naqmultiplechoicemultipleanswerpart}"""),
+    ('naqfilepart', r"""
+    \begin{naqfilepart}(application/pdf,text/*,.txt)[1024]
+    Upload your work for item %(n)s.
+    \end{naqfilepart}"""),
+    ('naqmatchingpart', r"""
+    \begin{naqmatchingpart}
+    Match the products for item %(n)s.
+    \begin{naqmlabels}
+        \naqmlabel[2] What is three times two?
+        \naqmlabel[0] What is four times three?
+        \naqmlabel[1] What is five times two thousand?
+    \end{naqmlabels}
+    \begin{naqmvalues}
+        \naqmvalue Twelve
+        \naqmvalue Ten thousand
+        \naqmvalue Six
+    \end{naqmvalues}
+    \end{naqmatchingpart}"""),
+    ('naqorderingpart', r"""
+    \begin{naqorderingpart}[randomize=true]
+    Order the events of item %(n)s.
+    \begin{naqmlabels}
+        \naqmlabel[1] 1
+        \naqmlabel[0] 2
+        \naqmlabel[2] 3
+    \end{naqmlabels}
+    \begin{naqmvalues}
+        \naqmvalue Second
+        \naqmvalue First
+        \naqmvalue Third
+    \end{naqmvalues}
+    \end{naqorderingpart}"""),
+    ('naqfillintheblankshortanswerpart', r"""
+    \begin{naqfillintheblankshortanswerpart}
+    Complete item %(n)s: \naqblankfield{001}[2] and \naqblankfield{002}[2]
+    \begin{naqregexes}
+        \naqregex{001}{yes} Yes
+        \naqregex{002}{no} No
+    \end{naqregexes}
+    \end{naqfillintheblankshortanswerpart}"""),
+    ('naqfillintheblankwithwordbankpart', r"""
+    \begin{naqfillintheblankwithwordbankpart}
+    Fill in the blanks of item %(n)s.
+    \begin{naqinput}
+        empty fields \naqblankfield{1} \naqblankfield{2} go here
+    \end{naqinput}
+    \begin{naqwordbank}[unique=false]
+        \naqwordentry{0}{montuno}{es}
+        \naqwordentry{1}{tiene}{es}
+        \naqwordentry{2}{tierra}{es}
+    \end{naqwordbank}
+    \begin{naqpaireditems}
+        \naqpaireditem{1}{2}
+        \naqpaireditem{2}{1}
+    \end{naqpaireditems}
+    \end{naqfillintheblankwithwordbankpart}"""),
+)
+
+QUESTION_TEMPLATE = r"""
+\begin{naquestion}[individual=true]
+\label{%(label)s}
+Question %(n)s.%(parts)s
+\end{naquestion}
+"""
+
+WORDBANK_QUESTION_TEMPLATE = r"""
+\begin{naquestionfillintheblankwordbank}[individual=true]
+\label{%(label)s}
+Question %(n)s shares its word bank between parts.
+\begin{naqwordbank}[unique=true]
+    \naqwordentry{0}{shikai}{en}
+    \naqwordentry{1}{bankai}{en}
+\end{naqwordbank}
+\begin{naqfillintheblankwithwordbankpart}
+    \begin{naqinput}
+        \naqblankfield{001} then \naqblankfield{002}
+    \end{naqinput}
+    \begin{naqpaireditems}
+        \naqpaireditem{001}{0}
+        \naqpaireditem{002}{1}
+    \end{naqpaireditems}
+\end{naqfillintheblankwithwordbankpart}
+\end{naquestionfillintheblankwordbank}
+"""
+
+POLL_TEMPLATE = r"""
+\begin{napoll}[not_before_date=2014-11-24,not_after_date=2014-12-04]
+\label{%(label)s}
+Poll %(n)s.
+\begin{naqmatchingpart}
+    \begin{naqmlabels}
+        \naqmlabel[1] 2
+        \naqmlabel[0] 1
+    \end{naqmlabels}
+    \begin{naqmvalues}
+        \naqmvalue Later
+        \naqmvalue Sooner
+    \end{naqmvalues}
+\end{naqmatchingpart}
+\end{napoll}
+"""
+
+
+def _refs(macro, labels):
+    return u''.join(u'\n\\%s{%s}' % (macro, x) for x in labels)
+
+
+class GeneratedBook(object):
+    """
+    The LaTeX ``body`` of a generated book and the number of each
+    assessment environment it holds (``counts``).
+    """
+
+    def __init__(self, body, counts):
+        self.body = body
+        self.counts = counts
+
+
+def _index_ranges(count, ranges):
+    """
+    ``ranges`` index ranges over ``count`` questions, drawing one
+    question each: one wide range followed by single questions.
+    """
+    wide = count - ranges
+    result = [(0, wide)]
+    result.extend((x, x) for x in range(wide + 1, count))
+    return result
+
+
+def generate_book(questions=100, parts_per_question=2, questions_per_section=10,
+                  sections_per_chapter=5, polls_per_chapter=2, bank_ranges=2,
+                  seed=0):
+    """
+    Generate a book with ``questions`` questions, as the body of a
+    document using the ``ntiassessment`` package.
+
+    Questions take their parts from :data:`PART_TEMPLATES` in turn, so
+    every kind of part is used once there are enough of them. Every
+    section gets a question set of its questions; every other
+    section also has a question bank drawing one question from each of
+    ``bank_ranges`` index ranges (fewer if the section is smaller), and
+    the remaining sections a randomized question set. Each section's
+    question set is the part of an assignment, and each chapter ends with
+    ``polls_per_chapter`` polls and a survey of them. Every eleventh
+    question instead has a word bank shared by its parts.
+
+    :keyword seed: Shuffles the order in which parts are used; the same
+        seed produces the same book.
+    """
+    templates = list(PART_TEMPLATES)
+    random.Random(seed).shuffle(templates)
+    counts = Counter()
+    out = []
+    part_index = 0
+    question = 0
+    section = 0
+    chapter = 0
+    while question < questions:
+        chapter += 1
+        out.append(u'\n\\chapter{Chapter %s}\n' % chapter)
+        for _ in range(sections_per_chapter):
+            if question >= questions:
+                break
+            section += 1
+            out.append(u'\n\\section{Section %s}\n' % section)
+            labels = []
+            for _ in range(min(questions_per_section, questions - question)):
+                question += 1
+                label = u'qid.bench.%s' % question
+                labels.append(label)
+                if question % 11 == 0:
+                    out.append(WORDBANK_QUESTION_TEMPLATE % {'label': label,
+                                                             'n': question})
+                    counts['naquestionfillintheblankwordbank'] += 1
+                    counts['naqfillintheblankwithwordbankpart'] += 1
+                    continue
+                parts = []
+                for _ in range(parts_per_question):
+                    name, template = templates[part_index % len(templates)]
+                    part_index += 1
+                    parts.append(template % {'n': question, 'double': question * 2})
+                    counts[name] += 1
+                out.append(QUESTION_TEMPLATE % {'label': label,
+                                                'n': question,
+                                                'parts': u''.join(parts)})
+                counts['naquestion'] += 1
+
+            qset = u'qset.bench.%s' % section
+            out.append(u'\n\\begin{naquestionset}<Section %s Questions>'
+                       u'\n\\label{%s}%s\n\\end{naquestionset}\n'
+                       % (section, qset, _refs('naquestionref', labels)))
+            counts['naquestionset'] += 1
+            if section % 2 and len(labels) > 1:
+                ranges = _index_ranges(len(labels), min(bank_ranges, len(labels)))
+                out.append(u'\n\\begin{naquestionbank}[draw=%s]<Section %s Bank>'
+                           u'\n\\label{qbank.bench.%s}%s'
+                           u'\n\\begin{naqindexranges}%s'
+                           u'\n\\end{naqindexranges}'
+                           u'\n\\end{naquestionbank}\n'
+                           % (len(ranges), section, section,
+                              _refs('naquestionref', labels),
+                              u''.join(u'\n\\naqindexrange{%s}{%s}{1}' % x
+                                       for x in ranges)))
+                counts['naquestionbank'] += 1
+                counts['naqindexrange'] += len(ranges)
+            else:
+                out.append(u'\n\\begin{narandomizedquestionset}'
+                           u'\n\\label{qrand.bench.%s}%s'
+                           u'\n\\end{narandomizedquestionset}\n'
+                           % (section, _refs('naquestionref', labels)))
+                counts['narandomizedquestionset'] += 1
+
+            category = u'no_submit' if section % 5 == 0 else u'Quizzes'
+            out.append(u'\n\\begin{naassignment}[not_before_date=2014-01-13,'
+                       u'category=%s,public=true]<Section %s Assignment>'
+                       u'\n\\label{assignment.bench.%s}'
+                       u'\n\\begin{naassignmentpart}[auto_grade=true]<Submission>{%s}'
+                       u'\n\\end{naassignmentpart}'
+                       u'\n\\end{naassignment}\n'
+                       % (category, section, section, qset))
+            counts['naassignment'] += 1
+
+        polls = []
+        for i in range(polls_per_chapter):
+            label = u'poll.bench.%s.%s' % (chapter, i + 1)
+            polls.append(label)
+            out.append(POLL_TEMPLATE % {'label': label, 'n': i + 1})
+            counts['napoll'] += 1
+            counts['naqmatchingpart'] += 1
+        if polls:
+            out.append(u'\n\\begin{nasurvey}[not_before_date=2014-11-24,'
+                       u'not_after_date=2014-12-04]<Chapter %s Survey>'
+                       u'\n\\label{survey.bench.%s}%s'
+                       u'\n\\end{nasurvey}\n'
+                       % (chapter, chapter, _refs('napollref', polls)))
+            counts['nasurvey'] += 1
+    return GeneratedBook(u''.join(out), counts)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Profiles the memory used by the digest, render and each assessment
+extractor of a generated book, writing the results as JSON::
+
+    python -m benchmarks.memory \\
+        --questions 1000 --output memory.json
+
+For each step, the ``tracemalloc`` snapshots taken before and after
+it are compared; allocations are charged to the innermost frame in
+this package on their stack, and the top sites are listed. Allocations
+with no such frame, such as most of the plasTeX DOM, only count in the
+traced totals. The peak
+resident set size of the process after each step is reported too.
+``tracemalloc`` needs Python 3; on Python 2 only the peak RSS is
+reported.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Windows
+    resource = None
+
+import simplejson as json
+
+from benchmarks.generator import generate_book
+
+from benchmarks.suite import run_book
+from benchmarks.suite import configure
+from benchmarks.suite import PACKAGE_DIR
+from benchmarks.suite import _environment
+from benchmarks.suite import latex_document
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The number of stack frames kept for each allocation, enough to
+#: reach this package from inside plasTeX and nti.assessment
+TRACEBACK_FRAMES = 25
+
+# ``ru_maxrss`` is in kilobytes except on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# Frames of the package tests the harness renders with are not sites
+_HARNESS_DIRS = os.path.join(PACKAGE_DIR, 'tests', '')
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process in bytes, or ``None``
+    where it cannot be measured.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+def _package_site(traceback):
+    if sys.version_info >= (3, 7):
+        # Frames are ordered oldest first; we want the innermost
+        traceback = reversed(traceback)
+    for frame in traceback:
+        if      frame.filename.startswith(PACKAGE_DIR) \
+            and not frame.filename.startswith(_HARNESS_DIRS):
+            return '%s:%s' % (os.path.relpath(frame.filename, PACKAGE_DIR),
+                              frame.lineno)
+    return None
+
+
+class MemoryProfile(object):
+    """
+    Observes the memory allocated by each step of :func:`.run_book`.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.phases = {}
+        self._snapshot = None
+
+    @property
+    def tracing(self):
+        return tracemalloc is not None and tracemalloc.is_tracing()
+
+    def start(self):
+        if self.tracing:
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def _sites(self, snapshot):
+        sites = {}
+        for stat in snapshot.compare_to(self._snapshot, 'traceback'):
+            site = _package_site(stat.traceback)
+            if site is None:
+                continue
+            entry = sites.setdefault(site, {'size': 0, 'count': 0})
+            entry['size'] += stat.size_diff
+            entry['count'] += stat.count_diff
+        ranked = sorted(sites.items(), key=lambda x: (-x[1]['size'], x[0]))
+        return [dict(entry, site=site) for site, entry in ranked[:self.top]]
+
+    def mark(self, name):
+        phase = self.phases[name] = {'peak_rss': peak_rss()}
+        if not self.tracing:
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        phase.update({'traced': current,
+                      'traced_peak': peak,
+                      'top': self._sites(snapshot)})
+        if hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9; otherwise the peak is that of the run so far
+            tracemalloc.reset_peak()
+        self._snapshot = snapshot
+
+
+def profile_memory(questions, seed=0, top=10, **kwargs):
+    """
+    Generate (see :func:`.generate_book`), digest, render and extract a
+    book of ``questions`` questions, tracing allocations. Returns a
+    dictionary with the ``phases`` of :class:`MemoryProfile` and the
+    final ``peak_rss``.
+
+    The extractor utilities must be registered.
+    """
+    generated = generate_book(questions, seed=seed, **kwargs)
+    latex = latex_document(generated.body)
+    profile = MemoryProfile(top)
+    started = False
+    if tracemalloc is None:  # pragma: no cover
+        logger.warning("tracemalloc is unavailable; reporting peak RSS only")
+    elif not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+        started = True
+    try:
+        run_book(latex, (profile,))
+    finally:
+        if started:
+            tracemalloc.stop()
+    return {'questions': questions,
+            'seed': seed,
+            'phases': profile.phases,
+            'peak_rss': peak_rss()}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Assessment rendering memory profile")
+    parser.add_argument('-n', '--questions', type=int, default=1000,
+                        help="Book size, in questions")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="Generator seed")
+    parser.add_argument('-t', '--top', type=int, default=10,
+                        help="Allocation sites listed per step")
+    parser.add_argument('-o', '--output',
+                        help="Write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    configure()
+    run = profile_memory(args.questions, seed=args.seed, top=args.top)
+
+    result = {'environment': _environment(), 'run': run}
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent='\t', sort_keys=True)
+    else:
+        json.dump(result, sys.stdout, indent='\t', sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fits how the time and the DOM nodes visited by the digest and the
+extractors grow with the size of a generated book, to catch
+superlinear regressions.
+
+The growth of a curve is summarized by the exponent ``k`` of the best
+fit of ``value = c * size ** k``. Over the sizes measured, ``N log N``
+has an exponent slightly above one; a curve whose exponent clearly
+exceeds that is reported.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import math
+
+from benchmarks.suite import run_benchmark
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The steps whose curves are fitted
+SCALING_PHASES = ('digest',
+                  '001.AssessmentExtractor',
+                  '040.LessonQuestionSetExtractor')
+
+#: How far above the ``N log N`` exponent a curve may grow; timings
+#: are noisy and include fixed costs
+DEFAULT_SLACK = 0.25
+
+
+def growth_exponent(sizes, values):
+    """
+    The least-squares slope of ``log(value)`` against ``log(size)``.
+    Values are floored at a microsecond, so a zero does not break the
+    fit.
+    """
+    xs = [math.log(x) for x in sizes]
+    ys = [math.log(max(y, 1e-6)) for y in values]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    return numerator / denominator
+
+
+def nlogn_exponent(sizes):
+    """
+    The :func:`growth_exponent` of ``N log N`` over ``sizes``.
+    """
+    return growth_exponent(sizes, [x * math.log(x) for x in sizes])
+
+
+def section_size(questions):
+    """
+    The questions per section used for a book of ``questions``: the
+    square root, so that sections, question banks and their index
+    ranges all grow with the book.
+    """
+    return max(10, int(math.sqrt(questions)))
+
+
+def measure_scaling(sizes, seed=0, phases=SCALING_PHASES):
+    """
+    Benchmark (see :func:`.run_benchmark`) a book of each of ``sizes``
+    questions, once for timings and once counting traversals. Each
+    question bank has an index range per question. Returns
+    ``{'sizes': sizes, 'timings': {phase: [...]}, 'visits': {phase: [...]}}``.
+
+    The extractor utilities must be registered.
+    """
+    result = {'sizes': list(sizes),
+              'timings': dict((x, []) for x in phases),
+              'visits': dict((x, []) for x in phases)}
+    for questions in sizes:
+        per_section = section_size(questions)
+        kwargs = {'questions_per_section': per_section,
+                  'bank_ranges': per_section}
+        timed = run_benchmark(questions, seed=seed, **kwargs)
+        counted = run_benchmark(questions, seed=seed, traversals=True, **kwargs)
+        for phase in phases:
+            result['timings'][phase].append(timed['timings'][phase])
+            result['visits'][phase].append(counted['phase_visits'][phase])
+        logger.info("%s questions: %s", questions, timed['timings'])
+    return result
+
+
+def superlinear_curves(curves, slack=DEFAULT_SLACK):
+    """
+    The curves of :func:`measure_scaling` that grow clearly faster than
+    ``N log N``, as ``(kind, phase, exponent, limit)`` tuples.
+    """
+    sizes = curves['sizes']
+    limit = nlogn_exponent(sizes) + slack
+    result = []
+    for kind in ('timings', 'visits'):
+        for phase, values in sorted(curves[kind].items()):
+            exponent = growth_exponent(sizes, values)
+            logger.info("%s of %s grow as N**%.2f", kind, phase, exponent)
+            if exponent > limit:
+                result.append((kind, phase, exponent, limit))
+    return result
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Times the digest, render and each assessment extractor on generated
+books of increasing size, writing the results as JSON::
+
+    python -m benchmarks.suite \\
+        --questions 100 1000 --output benchmark.json
+
+Extractor options may be set through their ``NTI_ASSESSMENT_*``
+environment variables to compare configurations.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import argparse
+import platform
+import importlib
+import contextlib
+
+from operator import itemgetter
+
+from timeit import default_timer
+
+from xml.dom import minidom
+
+import simplejson as json
+
+from zope import component
+from zope import interface
+
+from zope.configuration import xmlconfig
+
+import pkg_resources
+
+from nti.contentrendering.interfaces import IRenderedBook
+
+from nti.contentrendering.resources import ResourceRenderer
+
+from nti.contentrendering.tests import RenderContext
+from nti.contentrendering.tests import simpleLatexDocumentText
+
+from benchmarks.generator import generate_book
+
+import nti.contentrendering_assessment
+
+from nti.contentrendering_assessment.instrumentation import Recorder
+from nti.contentrendering_assessment.instrumentation import activated
+from nti.contentrendering_assessment.instrumentation import counting_traversals
+
+from nti.contentrendering_assessment.interfaces import ITOCSaveExtractor
+from nti.contentrendering_assessment.interfaces import IAssessmentExtractor
+from nti.contentrendering_assessment.interfaces import ILessonSurveyExtractor
+from nti.contentrendering_assessment.interfaces import IExtractionRunExtractor
+from nti.contentrendering_assessment.interfaces import ILessonQuestionSetExtractor
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The extractors timed, run as the rendering pipeline runs them: in the
+#: order of their utility names
+EXTRACTOR_INTERFACES = (IExtractionRunExtractor,
+                        IAssessmentExtractor,
+                        ILessonQuestionSetExtractor,
+                        ILessonSurveyExtractor,
+                        ITOCSaveExtractor)
+
+#: The directory of the package being measured
+PACKAGE_DIR = os.path.dirname(nti.contentrendering_assessment.__file__)
+
+#: The packages whose ``configure.zcml`` registers the extractors and
+#: what they use
+CONFIGURED_PACKAGES = ('nti.mimetype',
+                       'nti.assessment',
+                       'nti.contentrendering',
+                       'nti.externalization',
+                       'nti.contentrendering_assessment')
+
+
+@interface.implementer(IRenderedBook)
+class _BenchmarkBook(object):
+
+    def __init__(self, document, contentLocation, toc):
+        self.document = document
+        self.contentLocation = contentLocation
+        self.toc = toc
+
+
+class _BenchmarkTOC(object):
+    """
+    A table of contents with nothing in it, enough for the lesson
+    extractors to do all their work except attaching entries.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dom = minidom.parseString('<toc isCourse="false" />')
+
+    def save(self):
+        with open(self.filename, 'wb') as fp:
+            fp.write(self.dom.toxml(encoding='utf-8'))
+
+
+def latex_document(body):
+    """
+    A complete LaTeX document, using this package, around ``body``.
+    """
+    return simpleLatexDocumentText(preludes=(r'\usepackage{ntiassessment}',),
+                                   bodies=(body,))
+
+
+def configure():
+    """
+    Register the components of :data:`CONFIGURED_PACKAGES`, for running
+    outside the tests.
+    """
+    context = None
+    for name in CONFIGURED_PACKAGES:
+        context = xmlconfig.file('configure.zcml',
+                                 package=importlib.import_module(name),
+                                 context=context)
+
+
+def _extractors():
+    result = []
+    for iface in EXTRACTOR_INTERFACES:
+        result.extend(component.getUtilitiesFor(iface))
+    return sorted(result, key=itemgetter(0))
+
+
+@contextlib.contextmanager
+def _counting(enabled):
+    if not enabled:
+        yield None
+        return
+    recorder = Recorder()
+    with activated(recorder), counting_traversals(recorder):
+        yield recorder
+
+
+class _Timings(object):
+    """
+    Observes the seconds taken by each step of :func:`run_book`.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    def start(self):
+        self._last = default_timer()
+
+    def mark(self, name):
+        now = default_timer()
+        self.timings[name] = now - self._last
+        self._last = now
+
+
+class _Visits(object):
+    """
+    Observes the nodes visited during each step of :func:`run_book`.
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.visits = {}
+
+    def _total(self):
+        return sum(self.recorder.visits.values())
+
+    def start(self):
+        self._last = self._total()
+
+    def mark(self, name):
+        total = self._total()
+        self.visits[name] = total - self._last
+        self._last = total
+
+
+def run_benchmark(questions, seed=0, traversals=False, **kwargs):
+    """
+    Generate (see :func:`.generate_book`), digest, render and extract a
+    book of ``questions`` questions. Returns a dictionary with the
+    environment counts of the book and the ``timings``, in seconds, of
+    the digest, the render and each extractor by utility name.
+
+    If ``traversals`` is true, the nodes visited by each call site
+    during the whole run are returned as ``visits``, and the nodes
+    visited during each step as ``phase_visits``; the counting slows
+    the run, so timings are not comparable with other runs.
+
+    The extractor utilities must be registered.
+    """
+    generated = generate_book(questions, seed=seed, **kwargs)
+    latex = latex_document(generated.body)
+    timings = _Timings()
+    with _counting(traversals) as recorder:
+        observers = [timings]
+        if recorder is not None:
+            observers.append(_Visits(recorder))
+        index_size = run_book(latex, observers)
+    result = {'questions': questions,
+              'seed': seed,
+              'counts': dict(generated.counts),
+              'index_size': index_size,
+              'timings': timings.timings}
+    if recorder is not None:
+        result['visits'] = recorder.visits
+        result['phase_visits'] = observers[1].visits
+    return result
+
+
+def run_book(latex, observers=()):
+    """
+    Digest, render and extract the LaTeX document ``latex``. Each of
+    ``observers`` is started first and marked with the name of each
+    step (``digest``, ``render`` and the utility name of each
+    extractor) as it completes. Returns the size of the assessment
+    index.
+    """
+    def mark(name):
+        for observer in observers:
+            observer.mark(name)
+
+    for observer in observers:
+        observer.start()
+    with RenderContext(latex) as ctx:
+        mark('digest')
+
+        dom = ctx.dom
+        dom.getElementsByTagName('document')[0].filenameoverride = 'index'
+        render = ResourceRenderer.createResourceRenderer('XHTML', None)
+        render.importDirectory(PACKAGE_DIR)
+        render.render(dom)
+        mark('render')
+
+        toc = _BenchmarkTOC(os.path.join(ctx.docdir, 'eclipse-toc.xml'))
+        book = _BenchmarkBook(dom, ctx.docdir, toc)
+        for name, extractor in _extractors():
+            extractor.transform(book)
+            mark(name)
+
+        index = os.path.join(ctx.docdir, 'assessment_index.json')
+        return os.path.getsize(index) if os.path.exists(index) else 0
+
+
+def _environment():
+    try:
+        version = pkg_resources.get_distribution(
+            'nti.contentrendering_assessment').version
+    except pkg_resources.DistributionNotFound:  # pragma: no cover
+        version = None
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'version': version,
+            'options': dict((k, v) for k, v in os.environ.items()
+                            if k.startswith('NTI_ASSESSMENT_'))}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Assessment rendering benchmarks")
+    parser.add_argument('-n', '--questions', type=int, nargs='+',
+                        default=[100, 1000],
+                        help="Book sizes, in questions")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help="Runs of each size")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="Generator seed")
+    parser.add_argument('-t', '--traversals', action='store_true',
+                        help="Count the nodes visited by each call site")
+    parser.add_argument('-o', '--output',
+                        help="Write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    configure()
+    runs = []
+    for questions in args.questions:
+        for _ in range(args.repeat):
+            run = run_benchmark(questions, seed=args.seed,
+                                traversals=args.traversals)
+            logger.info("%s questions: %s", questions, run['timings'])
+            runs.append(run)
+
+    result = {'environment': _environment(), 'runs': runs}
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent='\t', sort_keys=True)
+    else:
+        json.dump(result, sys.stdout, indent='\t', sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import, division
+
+# disable: accessing protected members, too many methods
+# pylint: disable=W0212,R0904
+
+from hamcrest import is_
+from hamcrest import contains
+from hamcrest import close_to
+from hamcrest import has_key
+from hamcrest import less_than
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import greater_than
+
+from benchmarks.generator import generate_book
+from benchmarks.generator import PART_TEMPLATES
+
+from benchmarks.memory import tracemalloc
+from benchmarks.memory import profile_memory
+
+from benchmarks.scaling import nlogn_exponent
+from benchmarks.scaling import growth_exponent
+from benchmarks.scaling import superlinear_curves
+
+from benchmarks.suite import run_benchmark
+
+from nti.contentrendering.tests import buildDomFromString as _buildDomFromString
+
+from nti.contentrendering_assessment.tests import _simpleLatexDocument
+from nti.contentrendering_assessment.tests import AssessmentRenderingTestCase
+
+
+class TestGenerator(AssessmentRenderingTestCase):
+
+    def test_generate_book(self):
+        book = generate_book(30, seed=1)
+        assert_that(generate_book(30, seed=1).body, is_(book.body))
+        for name, _ in PART_TEMPLATES:
+            assert_that(book.counts[name], greater_than(0))
+        assert_that(book.counts['naqindexrange'], is_(2 * book.counts['naquestionbank']))
+        assert_that(generate_book(30, bank_ranges=5).counts['naqindexrange'],
+                    is_(5 * book.counts['naquestionbank']))
+
+        dom = _buildDomFromString(_simpleLatexDocument((book.body,)))
+        for name, count in book.counts.items():
+            assert_that(dom.getElementsByTagName(name), has_length(count))
+
+        for name in ('naquestion', 'naquestionfillintheblankwordbank',
+                     'naquestionset', 'naquestionbank', 'narandomizedquestionset',
+                     'naassignment', 'napoll', 'nasurvey'):
+            for element in dom.getElementsByTagName(name):
+                element.assessment_object()
+
+    def test_run_benchmark(self):
+        result = run_benchmark(12)
+        assert_that(result['counts'], has_key('naquestion'))
+        assert_that(result['index_size'], greater_than(0))
+        for name in ('digest', 'render',
+                     '000.ExtractionRunExtractor',
+                     '001.AssessmentExtractor',
+                     '040.LessonQuestionSetExtractor',
+                     '070.LessonSurveyExtractor',
+                     '999.TOCSaveExtractor'):
+            assert_that(result['timings'], has_key(name))
+
+
+class TestBenchmarkProfiles(AssessmentRenderingTestCase):
+    """
+    Counting traversals and tracing allocations slow the runs down; run
+    with ``tox -e benchmarks``.
+    """
+
+    level = 2
+
+    def test_traversal_scaling(self):
+        # The nodes this package visits grow about linearly with the book
+        def visits(questions):
+            result = run_benchmark(questions, traversals=True)
+            return sum(nodes for site, nodes in result['visits'].items()
+                       if site.startswith('nti.contentrendering_assessment.'))
+        small = visits(10)
+        assert_that(small, greater_than(0))
+        assert_that(visits(40), less_than(small * 4 * 1.5))
+
+    def test_run_benchmark_phase_visits(self):
+        result = run_benchmark(12, traversals=True)
+        assert_that(sum(result['phase_visits'].values()),
+                    is_(sum(result['visits'].values())))
+
+    def test_profile_memory(self):
+        result = profile_memory(12, top=3)
+        assert_that(result['peak_rss'], greater_than(0))
+        for name in ('digest', 'render', '001.AssessmentExtractor'):
+            phase = result['phases'][name]
+            assert_that(phase['peak_rss'], greater_than(0))
+            if tracemalloc is not None:
+                assert_that(phase['traced'], greater_than(0))
+                assert_that(phase['top'], has_length(less_than(4)))
+        if tracemalloc is not None:
+            assert_that(tracemalloc.is_tracing(), is_(False))
+
+
+class TestScalingFit(AssessmentRenderingTestCase):
+
+    def test_growth_exponent(self):
+        sizes = (100, 1000, 10000)
+        assert_that(growth_exponent(sizes, [3 * x for x in sizes]),
+                    close_to(1, 1e-9))
+        assert_that(growth_exponent(sizes, [x ** 2 for x in sizes]),
+                    close_to(2, 1e-9))
+        assert_that(nlogn_exponent(sizes), close_to(1.15, 0.01))
+
+        curves = {'sizes': sizes,
+                  'timings': {'linear': [0.1, 1.0, 10.0]},
+                  'visits': {'quadratic': [x ** 2 for x in sizes]}}
+        assert_that(superlinear_curves(curves),
+                    contains(contains('visits', 'quadratic',
+                                      close_to(2, 1e-9), close_to(1.4, 0.01))))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import, division
+
+# disable: accessing protected members, too many methods
+# pylint: disable=W0212,R0904
+
+from hamcrest import is_
+from hamcrest import assert_that
+
+from benchmarks.scaling import measure_scaling
+from benchmarks.scaling import superlinear_curves
+
+from nti.contentrendering_assessment.tests import AssessmentRenderingTestCase
+
+
+class TestScaling(AssessmentRenderingTestCase):
+    """
+    Renders books of up to ten thousand questions; run with
+    ``tox -e benchmarks``.
+    """
+
+    level = 2
+
+    SIZES = (100, 1000, 10000)
+
+    def test_at_most_n_log_n(self):
+        curves = measure_scaling(self.SIZES)
+        assert_that(superlinear_curves(curves), is_([]))
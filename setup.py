@@ -52,6 +52,7 @@ setup(
         'nti.mimetype',
         'nti.plasTeX',
         'nti.property',
+        'futures; python_version == "2.7"',
         'Paste',
         'PasteDeploy',
         'persistent',
@@ -9,23 +9,205 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
-import codecs
+import sys
+import pickle
+import shutil
+import hashlib
+import itertools
+import traceback
+import multiprocessing
+
+from collections import OrderedDict
+
+from timeit import default_timer
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    # Python 2 without the ``futures`` backport
+    futures = None
 
 import simplejson as json  # Needed for sort_keys, ensure_ascii
 
 from zope import component
 from zope import interface
 
+from paste.deploy.converters import asbool
+
 from nti.contentrendering.interfaces import IRenderedBook
 
+from nti.contentrendering_assessment.extractors.cache import element_digest
+from nti.contentrendering_assessment.extractors.cache import referenced_elements
+from nti.contentrendering_assessment.extractors.cache import AssessmentItemCache
+
+from nti.contentrendering_assessment.extractors.canonical import pinned
+from nti.contentrendering_assessment.extractors.canonical import text_digest
+from nti.contentrendering_assessment.extractors.canonical import CONTENT_DIGEST
+from nti.contentrendering_assessment.extractors.canonical import canonical_json
+from nti.contentrendering_assessment.extractors.canonical import content_digest
+from nti.contentrendering_assessment.extractors.canonical import source_date_epoch
+
+from nti.contentrendering_assessment.extractors.database import DATABASE_NAME
+from nti.contentrendering_assessment.extractors.database import IndexDatabase
+
+from nti.contentrendering_assessment.extractors.engine import extraction_engine
+from nti.contentrendering_assessment.extractors.engine import UNINTERESTING_ATTR
+from nti.contentrendering_assessment.extractors.engine import mark_uninteresting
+
+from nti.contentrendering_assessment.extractors.ndjson import NDJSON_NAME
+from nti.contentrendering_assessment.extractors.ndjson import ItemLinesWriter
+
+from nti.contentrendering_assessment.extractors.normalized import INDEX_NESTED
+from nti.contentrendering_assessment.extractors.normalized import INDEX_FORMATS
+from nti.contentrendering_assessment.extractors.normalized import normalize_item
+from nti.contentrendering_assessment.extractors.normalized import INDEX_NORMALIZED
+
+from nti.contentrendering_assessment.extractors.offsets import OFFSETS_NAME
+from nti.contentrendering_assessment.extractors.offsets import write_offsets
+
+from nti.contentrendering_assessment.extractors.report import ItemReport
+from nti.contentrendering_assessment.extractors.report import REPORT_NAME
+from nti.contentrendering_assessment.extractors.report import BUDGET_FAIL
+from nti.contentrendering_assessment.extractors.report import BUDGET_WARN
+from nti.contentrendering_assessment.extractors.report import BUDGET_ACTIONS
+
+from nti.contentrendering_assessment.extractors.shards import SHARDS_DIR
+from nti.contentrendering_assessment.extractors.shards import ROOT_SHARD
+from nti.contentrendering_assessment.extractors.shards import file_entry
+from nti.contentrendering_assessment.extractors.shards import shard_name
+from nti.contentrendering_assessment.extractors.shards import write_manifest
+
+from nti.contentrendering_assessment.extractors.solutions import SOLUTIONS_NAME
+from nti.contentrendering_assessment.extractors.solutions import strip_solutions
+from nti.contentrendering_assessment.extractors.solutions import write_solutions
+
+from nti.contentrendering_assessment.extractors.writer import output_file
+from nti.contentrendering_assessment.extractors.writer import COMPRESSED_SUFFIX
+from nti.contentrendering_assessment.extractors.writer import StreamingJSONWriter
+
+from nti.contentrendering_assessment.instrumentation import count
+from nti.contentrendering_assessment.instrumentation import timed
+from nti.contentrendering_assessment.instrumentation import timed_method
+from nti.contentrendering_assessment.instrumentation import instrumenting
+
 from nti.contentrendering_assessment.interfaces import IAssessmentExtractor
 
+from nti.contentrendering_assessment.ntibase import release_assessment_objects
+
+from nti.contentrendering_assessment.utils import apply_options
+
 from nti.externalization.internalization import find_factory_for
 from nti.externalization.externalization import toExternalObject
 from nti.externalization.internalization import update_from_external_object
 
 logger = __import__('logging').getLogger(__name__)
 
+#: The name of the index written to the output directory
+INDEX_NAME = 'assessment_index.json'
+
+#: Round-trip verification policies: verify every item, a deterministic
+#: sample of items chosen by NTIID, one item of each concrete class, or
+#: none at all.
+VERIFY_FULL = 'full'
+VERIFY_SAMPLED = 'sampled'
+VERIFY_TYPES = 'types'
+VERIFY_OFF = 'off'
+VERIFICATION_POLICIES = (VERIFY_FULL, VERIFY_SAMPLED, VERIFY_TYPES, VERIFY_OFF)
+
+
+def _ntiid_fraction(ntiid):
+    """
+    Map an NTIID to a stable number in ``[0, 1)``.
+    """
+    digest = hashlib.md5(ntiid.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+def _copy_external(ext_obj):
+    """
+    Copy the mappings and sequences of an externalized object; the
+    (immutable) leaf values are shared.
+    """
+    if isinstance(ext_obj, Mapping):
+        return {k: _copy_external(v) for k, v in ext_obj.items()}
+    if isinstance(ext_obj, (list, tuple)):
+        return [_copy_external(x) for x in ext_obj]
+    return ext_obj
+
+
+#: ``(extractor, elements, objects)`` of the batch of items being
+#: externalized, shared with the worker processes forked for it. Workers
+#: inherit the DOM, the item elements and the objects already
+#: constructed for them through ``fork`` instead of having them pickled.
+_worker_state = None
+
+
+def _fork_context():
+    """
+    The multiprocessing context used for worker processes, or ``None``
+    if this platform cannot fork.
+    """
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:  # pragma: no cover
+        # Python 2 always forks on POSIX
+        return multiprocessing if hasattr(os, 'fork') else None
+    except ValueError:  # pragma: no cover
+        return None
+    if sys.version_info < (3, 7):  # pragma: no cover
+        # Pools only take a context from Python 3.7 and use the
+        # default before that, which must fork.
+        if multiprocessing.get_start_method(allow_none=True) not in (None, 'fork'):
+            return None
+        return multiprocessing
+    return context
+
+
+def _process_pool(processes):
+    context = _fork_context()
+    if context is multiprocessing:  # pragma: no cover
+        return futures.ProcessPoolExecutor(processes)
+    return futures.ProcessPoolExecutor(processes, mp_context=context)
+
+
+def _portable_error(error):
+    """
+    ``error`` as it will arrive in the parent process, or ``None`` if it
+    cannot be pickled.
+    """
+    try:
+        return pickle.loads(pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _externalize_in_worker(jobs):
+    """
+    Externalize and verify the items of the ``jobs``, ``(index, verify)``
+    pairs where ``index`` is that of the element and its object in the
+    shared :data:`_worker_state`. Returns ``(ext_obj, error)`` pairs.
+    Failures are reported as the exception, if it can be pickled, and
+    its formatted traceback, which cannot cross the process boundary.
+    """
+    extractor, elements, objects = _worker_state
+    results = []
+    for index, verify in jobs:
+        element = elements[index]
+        try:
+            ext_obj = extractor._finish_item(element, objects[index], verify)
+        except Exception as e:  # pylint: disable=broad-except
+            error = (_portable_error(e), traceback.format_exc())
+            results.append((None, error))
+        else:
+            results.append((_copy_external(ext_obj), None))
+        extractor._release_objects(element)
+    return results
+
 
 @component.adapter(IRenderedBook)
 @interface.implementer(IAssessmentExtractor)
@@ -46,134 +228,869 @@ class _AssessmentExtractor(object):
                             # As containing, except 'filename' will be null/None
                     }
             }
+
+    Options may be given as keyword arguments or through
+    ``NTI_ASSESSMENT_<OPTION>`` environment variables.
     """
 
-    def __init__(self, book=None):
-        pass
+    #: A directory in which externalized items are cached between
+    #: builds, keyed by a digest of their TeX source; ``None`` disables
+    #: the cache.
+    cache_dir = None
+
+    #: If true, ``assessment_index.json`` is written section by section
+    #: as the document is walked instead of being built in memory first.
+    streaming = False
+
+    #: Which items get the round-trip check; one of
+    #: :data:`VERIFICATION_POLICIES`. The policy used is recorded in the
+    #: index ``Metadata``.
+    verification = VERIFY_FULL
+
+    #: The fraction of items checked by the ``sampled`` policy
+    verification_sample = 0.1
+
+    #: The number of worker processes used to externalize and verify
+    #: items; values below 2 do the work in this process. Items are
+    #: still constructed here, a batch at a time (the whole book, or a
+    #: shard or streamed section), and workers are forked for each
+    #: batch once its items have been.
+    processes = 0
+
+    #: If true, timings and counters for the run are written to
+    #: ``assessment_instrumentation.json`` beside the index.
+    instrument = False
+
+    #: If true, the DOM nodes visited by each call site are counted
+    #: into the instrumentation report (implies :attr:`instrument`)
+    traversals = False
+
+    #: If true, the size as written to the index, cost and part count
+    #: of every item is written to ``assessment_item_report.json``
+    item_report = False
+
+    #: The number of heaviest items listed in the item report
+    item_report_top = 20
+
+    #: Per-item budgets: the size in bytes as written, the seconds
+    #: spent constructing and externalizing, and the number of parts
+    #: (questions, for sets). Zero disables a budget.
+    item_max_bytes = 0
+    item_max_seconds = 0.0
+    item_max_parts = 0
+
+    #: What an item over budget does; one of
+    #: :data:`~.report.BUDGET_ACTIONS`
+    item_budget_action = BUDGET_WARN
+
+    #: How many externalized items keep their assessment objects (and
+    #: those of their parts) cached on their elements, most recently
+    #: externalized first; older ones are released so they can be
+    #: freed. A negative value keeps them all, zero releases each item
+    #: as soon as it is externalized. Question sets and assignments
+    #: rebuild the objects of released questions they refer to, so a
+    #: small cache avoids most of that work; those questions are held,
+    #: and released, like the items themselves.
+    object_cache_size = -1
+
+    #: Whether items embed the questions, sets and polls they contain,
+    #: or refer to them by NTIID; one of :data:`~.normalized.INDEX_FORMATS`.
+    #: The format is recorded in the index ``Metadata``.
+    index_format = INDEX_NESTED
+
+    #: If true, solutions and explanations are left out of the index
+    #: and written, by question NTIID, to ``assessment_solutions.json``
+    #: beside it, which the ``solutions_file`` of the index ``Metadata``
+    #: then names. A solutions file left by an earlier build is removed
+    #: when none is written.
+    split_solutions = False
+
+    #: If true, instead of ``assessment_index.json`` the index is
+    #: written to the ``assessment_shards`` directory, one file per
+    #: top-level section, with a manifest (see :mod:`.shards`).
+    #: Otherwise, a directory left by an earlier build is removed.
+    sharded = False
+
+    #: If true, the byte offset and length of every section and item
+    #: in ``assessment_index.json`` is written to
+    #: ``assessment_index_offsets.json`` (see :mod:`.offsets`); a file
+    #: left by an earlier build is removed otherwise. Not available for
+    #: a :attr:`sharded` index.
+    offsets = False
+
+    #: If true, the sections and items of the index are also written to
+    #: the ``assessment_index.sqlite`` database (see :mod:`.database`)
+    sqlite = False
+
+    #: If true, the items of the index are also written, one per line
+    #: with their section, to ``assessment_items.ndjson`` (see
+    #: :mod:`.ndjson`)
+    ndjson = False
+
+    #: If true, the index is written without indentation or spaces
+    minified = False
+
+    #: If true, a gzip-compressed copy of ``assessment_index.json`` is
+    #: written to ``assessment_index.json.gz`` in the same pass.
+    #: With either option the files are the same bytes for the same
+    #: input on every build: the times items get when they are built
+    #: are pinned to :func:`~.canonical.source_date_epoch`.
+    precompressed = False
+
+    #: If true, each item gets a ``ContentDigest``: the SHA-256 of its
+    #: canonical JSON without that key or the times that change on
+    #: every build (see :func:`~.canonical.content_digest`). The index
+    #: ``Metadata`` (or the manifest of a sharded index) gets one for
+    #: the whole index, covering every section and item digest.
+    digests = False
+
+    #: Option names and the converters for their environment values
+    _options = {
+        'cache_dir': None,
+        'streaming': asbool,
+        'verification': None,
+        'verification_sample': float,
+        'processes': int,
+        'instrument': asbool,
+        'traversals': asbool,
+        'item_report': asbool,
+        'item_report_top': int,
+        'item_max_bytes': int,
+        'item_max_seconds': float,
+        'item_max_parts': int,
+        'item_budget_action': None,
+        'object_cache_size': int,
+        'index_format': None,
+        'split_solutions': asbool,
+        'sharded': asbool,
+        'offsets': asbool,
+        'sqlite': asbool,
+        'ndjson': asbool,
+        'minified': asbool,
+        'precompressed': asbool,
+        'digests': asbool,
+    }
+
+    _cache = None
+
+    #: The :class:`~.ItemReport` of the current :meth:`transform`, if
+    #: items are being reported on
+    _report = None
+
+    #: Externalized items computed ahead of the index walk, by ``id()``
+    #: of their element
+    _prepared = None
+
+    #: Whether the running transform externalizes items in worker
+    #: processes
+    _forking = False
+
+    #: The elements whose assessment objects are still cached, oldest
+    #: first, when :attr:`object_cache_size` bounds them
+    _held = None
+
+    #: The NTIIDs of the items of the index, when it is normalized
+    _item_ntiids = None
+
+    #: The answers taken out of the items, by question NTIID, when
+    #: solutions are split from the index
+    _solutions = None
+
+    #: The name of the solutions file, once it has been written
+    _solutions_file = None
+
+    #: The ``(offset, length)`` of the sections and items written so
+    #: far, by NTIID, when offsets are recorded
+    _offsets = None
+
+    #: The :class:`~.IndexDatabase` being written, if any
+    _database = None
+
+    #: The :class:`~.ItemLinesWriter` being written, if any
+    _lines = None
+
+    #: Canonical descriptions of the sections and items written so
+    #: far, when digests are computed
+    _digested = None
+
+    #: The time the volatile times of items are pinned to, if any
+    _pinned_time = None
+
+    #: The number of externalizations performed by the last
+    #: :meth:`transform`
+    externalizations = 0
+
+    def __init__(self, book=None, **kwargs):
+        apply_options(self, self._options, kwargs)
 
     def transform(self, book, savetoc=True, outpath=None):
+        """
+        Write ``assessment_index.json`` for the book and return the index
+        dictionary. In streaming mode the index is never held in memory
+        and ``None`` is returned.
+        """
         __traceback_info__ = book, savetoc, outpath
         outpath = outpath or book.contentLocation
         outpath = os.path.expanduser(outpath)
-        target = os.path.join(outpath, 'assessment_index.json')
+        with instrumenting(book, 'transform.AssessmentExtractor',
+                           self.instrument, outpath, self.traversals):
+            try:
+                return self._transform(book, outpath)
+            finally:
+                # Only still open if the transform failed
+                for output in (self._database, self._lines):
+                    if output is not None:
+                        output.abort()
+                self._database = self._lines = None
 
-        items = {}
-        index = {'Items': items}
-        documents = book.document.getElementsByTagName('document')
-        if not documents:
-            return
+    def _transform(self, book, outpath):
+        target = os.path.join(outpath, INDEX_NAME)
+
+        if self.verification not in VERIFICATION_POLICIES:
+            raise ValueError("Unknown verification policy", self.verification)
+        if self.item_budget_action not in BUDGET_ACTIONS:
+            raise ValueError("Unknown budget action", self.item_budget_action)
+        if self.index_format not in INDEX_FORMATS:
+            raise ValueError("Unknown index format", self.index_format)
+        if self.offsets and self.sharded:
+            raise ValueError("Offsets are not available for a sharded index")
+        self._verified_types = set()
+        budgets = self._item_budgets()
+        self._report = None
+        if self.item_report or budgets:
+            self._report = ItemReport()
+
+        self.externalizations = 0
+        self._held = OrderedDict()
+        if self.cache_dir:
+            self._cache = AssessmentItemCache(self.cache_dir)
+
+        # Items and question sets look up their parts through the index
+        with extraction_engine(book) as engine, engine.installed():
+            items = {}
+            index = {'Items': items}
+            section = engine.index_section
+            if section is None:
+                return
+            self._solutions = {} if self.split_solutions else None
+            self._solutions_file = None
+            self._offsets = None
+            if self.offsets:
+                self._offsets = {}
+            self._item_ntiids = None
+            if self.index_format == INDEX_NORMALIZED:
+                self._item_ntiids = set(x.ntiid for x in self._iter_items(section))
+            if self.sqlite and not self._is_uninteresting(section.element):
+                self._database = IndexDatabase(os.path.join(outpath, DATABASE_NAME))
+                self._add_sections(section)
+            if self.ndjson and not self._is_uninteresting(section.element):
+                self._lines = ItemLinesWriter(os.path.join(outpath, NDJSON_NAME))
+            self._pinned_time = None
+            if self.minified or self.precompressed:
+                self._pinned_time = source_date_epoch()
+            self._digested = None
+            if self.digests:
+                self._digested = []
+                self._digest_sections(section)
+            self._forking = self._parallel()
 
-        self._build_index(documents[0], index['Items'])
-        index['href'] = index.get('href', 'index.html')
-
-        if items:  # check if there is something
-            logger.info("extracting assessments to %s", target)
-            with codecs.open(target, 'w', encoding='utf-8') as fp:
-                # sort_keys for repeatability. Do force ensure_ascii because even though
-                # we're using codes to  encode automatically, the reader might not
-                # decode
-                json.dump(index,
-                          fp,
-                          indent='\t',
-                          sort_keys=True,
-                          ensure_ascii=True)
+            if self.sharded:
+                index = None
+                if not self._is_uninteresting(section.element):
+                    directory = os.path.join(outpath, SHARDS_DIR)
+                    logger.info("sharding assessments to %s", directory)
+                    with timed('shard_index'):
+                        self._shard_index(section, directory)
+            elif self.streaming:
+                index = None
+                if not self._is_uninteresting(section.element):
+                    logger.info("streaming assessments to %s", target)
+                    with timed('stream_index'):
+                        self._stream_index(section, target, self.precompressed)
+                    self._write_offsets(target)
+            else:
+                with timed('build_index'):
+                    self._build_index(section, index['Items'])
+                self._write_solutions(outpath)
+                index['href'] = index.get('href', 'index.html')
+                index['Metadata'] = self._index_metadata()
+                if items:  # check if there is something
+                    logger.info("extracting assessments to %s", target)
+                    with output_file(target, self.precompressed) as fp:
+                        # sort_keys for repeatability. Do force ensure_ascii because even though
+                        # we're using codes to  encode automatically, the reader might not
+                        # decode
+                        with timed('json_dump'):
+                            if self._offsets is not None:
+                                writer = StreamingJSONWriter(fp, ensure_ascii=True,
+                                                             **self._json_format())
+                                self._entry_writer(index)(writer)
+                            else:
+                                json.dump(index,
+                                          fp,
+                                          sort_keys=True,
+                                          ensure_ascii=True,
+                                          **self._json_format())
+                    self._write_offsets(target)
+        if self._database is not None:
+            self._database.set_metadata(self._index_metadata())
+            self._database.close()
+            self._database = None
+        if self._lines is not None:
+            self._lines.close()
+            self._lines = None
+        if not self.sharded:
+            # Left by an earlier, sharded build
+            directory = os.path.join(outpath, SHARDS_DIR)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+        if not self._solutions_file:
+            # Nothing was split from this build
+            path = os.path.join(outpath, SOLUTIONS_NAME)
+            if os.path.exists(path):
+                os.remove(path)
+        self._solutions = None
+        logger.info("externalized %s assessment objects",
+                    self.externalizations)
+        if self._cache is not None:
+            logger.info("assessment item cache: %s hits, %s misses",
+                        self._cache.hits, self._cache.misses)
+            count('cache_hits', self._cache.hits)
+            count('cache_misses', self._cache.misses)
+        self._held = None
+        if self._report is not None:
+            self._finish_report(outpath, budgets)
         return index
 
+    def _write_offsets(self, target):
+        path = os.path.join(os.path.dirname(target), OFFSETS_NAME)
+        if self._offsets is not None:
+            write_offsets(path, self._offsets, os.path.getsize(target))
+        elif os.path.exists(path):
+            # Left by an earlier build, it no longer matches ``target``
+            os.remove(path)
+        self._offsets = None
+
+    def _item_budgets(self):
+        """
+        The enabled per-item budgets, by :class:`~.ItemReport` key.
+        """
+        budgets = {'bytes': self.item_max_bytes,
+                   'seconds': self.item_max_seconds,
+                   'parts': self.item_max_parts}
+        return dict((k, v) for k, v in budgets.items() if v)
+
+    def _finish_report(self, outpath, budgets):
+        report = self._report
+        if self.item_report:
+            report.write(os.path.join(outpath, REPORT_NAME),
+                         self.item_report_top, budgets)
+        violations = report.violations(budgets)
+        for ntiid, key, value, budget in violations:
+            logger.warning("assessment item %s is over budget: %s %s > %s",
+                           ntiid, key, value, budget)
+        if violations and self.item_budget_action == BUDGET_FAIL:
+            raise ValueError("Assessment items over budget", violations)
+
+    def _index_metadata(self, digest=True):
+        result = {'verification': self.verification}
+        if self.index_format != INDEX_NESTED:
+            # The nested format is assumed when none is recorded
+            result['format'] = self.index_format
+        if self._solutions_file:
+            result['solutions_file'] = self._solutions_file
+        if digest and self._digested is not None:
+            result[CONTENT_DIGEST] = text_digest('\n'.join(sorted(self._digested)))
+        return result
+
+    def _write_solutions(self, outpath):
+        """
+        Write the solutions split from the items, once all of them have
+        been. Only then does the index ``Metadata`` name the file.
+        """
+        if self._solutions:
+            write_solutions(os.path.join(outpath, SOLUTIONS_NAME),
+                            self._solutions, self._index_metadata())
+            self._solutions_file = SOLUTIONS_NAME
+
     def _to_external_object(self, obj):
         # Need to ensure we include solutions here
+        self.externalizations += 1
+        count('externalizations')
         result = toExternalObject(obj, name='solutions')
         return result
 
-    def _build_index(self, element, index):
+    def _build_index(self, section, index):
         """
-        Recurse through the element adding assessment objects to the index,
+        Recurse through the section adding assessment objects to the index,
         keyed off of NTIIDs.
 
         :param dict index: The containing index node. Typically, this will be
                an ``Items`` dictionary in a containing index.
         """
-        if self._is_uninteresting(element):
+        if self._is_uninteresting(section.element):
             # It's important to identify uninteresting nodes because
             # some uninteresting nodes that would never make it into the TOC or
             # otherwise be noticed actually can present with hard-coded duplicate
             # NTIIDs, which would cause us to fail.
             return
+        self._prepare_items(section)
+        try:
+            self._index_section(section, index)
+        finally:
+            self._prepared = None
 
-        ntiid = getattr(element, 'ntiid', None)
-        if not ntiid:
-            # If we hit something without an ntiid, it's not a section-level
-            # element, it's a paragraph or something like it. Thus we collapse into
-            # the parent. Obviously, we'll only look for AssessmentObjects
-            # inside of here
-            element_index = index
-        else:
-            assert ntiid not in index, \
-                   ("NTIIDs must be unique", ntiid, index.keys())
-            element_index = index[ntiid] = {}
-
-            element_index['NTIID'] = ntiid
-            element_index['filename'] = getattr(element, 'filename', None)
-            if      not element_index['filename'] \
-                and getattr(element, 'filenameoverride', None):
-                # FIXME: XXX: We are assuming the filename extension.
-                # Why aren't we finding these at filename? See EclipseHelp.zpts for
-                # comparison
-                override = getattr(element, 'filenameoverride')
-                element_index['filename'] = override + '.html'
-            filename = element_index['filename']
-            element_index['href'] = getattr(element, 'url', filename)
+    def _prepare_items(self, section):
+        if self._forking:
+            # Hand the whole book to the workers at once rather than a
+            # section at a time.
+            items = list(self._iter_items(section))
+            ext_objs = self._externalize_in_pool(items)
+            self._prepared = dict(zip(map(id, items), ext_objs))
+
+    def _iter_items(self, section):
+        for child in section.items:
+            yield child
+        for child in section.sections or ():
+            for item in self._iter_items(child):
+                yield item
+
+    def _section_header(self, section):
+        """
+        The ``NTIID``, ``filename`` and ``href`` of a named section.
+        """
+        if not section.ntiid:
+            return {}
+        element = section.element
+        filename = getattr(element, 'filename', None)
+        if not filename and getattr(element, 'filenameoverride', None):
+            # FIXME: XXX: We are assuming the filename extension.
+            # Why aren't we finding these at filename? See EclipseHelp.zpts for
+            # comparison
+            filename = getattr(element, 'filenameoverride') + '.html'
+        return {'NTIID': section.ntiid,
+                'filename': filename,
+                'href': getattr(element, 'url', filename)}
+
+    def _section_items(self, section):
+        result = {}
+        ext_objs = self._externalize_items(section.items)
+        for child, ext_obj in zip(section.items, ext_objs):
+            if self._solutions is not None:
+                ext_obj = strip_solutions(ext_obj, self._solutions)
+            if self._item_ntiids is not None:
+                ext_obj = normalize_item(ext_obj, self._item_ntiids)
+            if self._pinned_time is not None:
+                ext_obj = pinned(ext_obj, self._pinned_time)
+            if self._digested is not None:
+                digest = content_digest(ext_obj)
+                ext_obj = dict(ext_obj)
+                ext_obj[CONTENT_DIGEST] = digest
+                self._digested.append(canonical_json(['item', section.ntiid,
+                                                      child.ntiid, digest]))
+            if self._report is not None:
+                self._report.measure(child.ntiid, ext_obj, **self._json_format())
+            result[child.ntiid] = ext_obj
+        if self._database is not None:
+            self._database.add_items(section.ntiid, result)
+        if self._lines is not None:
+            self._lines.add_items(self._section_header(section), result)
+        return result
+
+    def _add_sections(self, section, parent=None):
+        """
+        Add the named sections of the index, from ``section`` down, to
+        the database.
+        """
+        if section.ntiid:
+            header = self._section_header(section)
+            self._database.add_section(section.ntiid, header['filename'],
+                                       header['href'], parent)
+            parent = section.ntiid
+        for child in section.sections or ():
+            self._add_sections(child, parent)
 
+    def _digest_sections(self, section, parent=None):
+        if section.ntiid:
+            header = self._section_header(section)
+            self._digested.append(canonical_json(['section', section.ntiid,
+                                                  parent, header]))
+            parent = section.ntiid
+        for child in section.sections or ():
+            self._digest_sections(child, parent)
+
+    def _child_sections(self, section):
+        result = {}
+        for child in section.sections:
+            assert child.ntiid not in result, \
+                   ("NTIIDs must be unique", child.ntiid, result.keys())
+            result[child.ntiid] = child
+        return result
+
+    def _index_section(self, section, index):
+        element_index = self._section_header(section)
         __traceback_info__ = element_index
-        assessment_objects = element_index.setdefault('AssessmentItems', {})
-
-        for child in element.childNodes:
-            ass_obj = getattr(child, 'assessment_object', None)
-            if callable(ass_obj):
-                int_obj = ass_obj()
-                # Verify that we can round-trip this object
-                self._ensure_roundtrips(int_obj, provenance=child)
-                ext_obj = self._to_external_object(int_obj)
-                assessment_objects[child.ntiid] = ext_obj
-                # assessment_objects are leafs, never have children to worry
-                # about
-            elif child.hasChildNodes():  # Recurse for children if needed
-                if getattr(child, 'ntiid', None):
-                    # we have a child with an NTIID; make sure we have a
-                    # container for it
-                    containing_index = element_index.setdefault('Items', {})
-                else:
-                    # an unnamed thing; wrap it up with us; should only
-                    # have AssessmentItems
-                    containing_index = element_index
-                self._build_index(child, containing_index)
-
-    def _ensure_roundtrips(self, assm_obj, provenance=None):
+        element_index['AssessmentItems'] = self._section_items(section)
+        if section.sections is not None:
+            children = element_index['Items'] = {}
+            for child in section.sections:
+                self._index_section(child, children)
+
+        if section.ntiid:
+            assert section.ntiid not in index, \
+                   ("NTIIDs must be unique", section.ntiid, index.keys())
+            index[section.ntiid] = element_index
+        else:
+            # an unnamed thing; wrap it up with the container
+            index.update(element_index)
+
+    def _section_writer(self, section):
+        """
+        Return a callable that writes the index entry for ``section``
+        to a :class:`StreamingJSONWriter`, externalizing its items only
+        when they are reached.
+        """
+        def write(writer):
+            members = list(self._section_header(section).items())
+            members.append(('AssessmentItems',
+                            self._section_items_writer(section)))
+            if section.sections is not None:
+                children = self._child_sections(section)
+                members.append(('Items', self._sections_writer(children)))
+            writer.write_object(members)
+        return write
+
+    def _sections_writer(self, sections):
+        def write(writer):
+            writer.write_object(((ntiid, self._section_writer(child))
+                                 for ntiid, child in sections.items()),
+                                offsets=self._offsets)
+        return write
+
+    def _section_items_writer(self, section):
+        # The items are built here, and dropped once written, so that
+        # only one section's items are held while its children are
+        # written
+        def write(writer):
+            items = self._section_items(section)
+            writer.write_object(items.items(), offsets=self._offsets)
+        return write
+
+    def _items_writer(self, items):
+        def write(writer):
+            writer.write_object(items.items(), offsets=self._offsets)
+        return write
+
+    def _entry_writer(self, entry):
+        """
+        Return a callable that writes an ``entry`` of the index built in
+        memory, the index itself or one of its sections, so that the
+        offsets of the sections and items in it are recorded.
+        """
+        def write(writer):
+            members = []
+            for key, value in entry.items():
+                if key == 'Items':
+                    value = self._entries_writer(value)
+                elif key == 'AssessmentItems':
+                    value = self._items_writer(value)
+                members.append((key, value))
+            writer.write_object(members)
+        return write
+
+    def _entries_writer(self, entries):
+        def write(writer):
+            writer.write_object(((ntiid, self._entry_writer(entry))
+                                 for ntiid, entry in entries.items()),
+                                offsets=self._offsets)
+        return write
+
+    def _json_format(self):
+        """
+        The ``indent`` and ``separators`` the index is written with.
+        """
+        if self.minified:
+            return {'indent': None, 'separators': (',', ':')}
+        return {'indent': '\t', 'separators': None}
+
+    def _stream_index(self, section, target, compress=False, whole=True):
+        """
+        Write the index for the root ``section`` directly to ``target``,
+        one section at a time, in the same key order as :func:`json.dump`
+        with ``sort_keys``. The ``Metadata`` follows the ``Items``, so
+        it is only computed once they have been written; if this is the
+        ``whole`` index, the solutions and digest of the book are
+        finished by then.
+        """
+        def metadata(writer):
+            if whole:
+                self._write_solutions(os.path.dirname(target))
+            writer.write_value(self._index_metadata(whole))
+        if section.ntiid:
+            items = self._sections_writer({section.ntiid: section})
+        else:
+            items = self._section_writer(section)
+        with output_file(target, compress) as fp:
+            writer = StreamingJSONWriter(fp, ensure_ascii=True,
+                                         **self._json_format())
+            writer.write_object([('Items', items),
+                                 ('Metadata', metadata),
+                                 ('href', 'index.html')])
+
+    def _shards(self, section):
+        """
+        ``(name, ntiid, shard)`` for each shard of the root ``section``:
+        the root with only its own items, and the root with only one of
+        its child sections, for each of them.
+        """
+        # Keeping an empty ``Items`` if the root has one
+        sections = [] if section.sections is not None else None
+        yield ROOT_SHARD, section.ntiid, section.pruned(section.items, sections)
+        seen = set()
+        for child in section.sections or ():
+            assert child.ntiid not in seen, ("NTIIDs must be unique", child.ntiid)
+            seen.add(child.ntiid)
+            yield shard_name(child.ntiid), child.ntiid, section.pruned([], [child])
+
+    def _section_ntiids(self, section):
+        if section.ntiid:
+            yield section.ntiid
+        for child in section.sections or ():
+            for ntiid in self._section_ntiids(child):
+                yield ntiid
+
+    def _shard_index(self, section, directory):
+        """
+        Write the index for the root ``section`` as shards in
+        ``directory``, with their manifest. The shards are written to a
+        new directory that then replaces ``directory``, so no stale
+        shard is left behind, and an index written whole by an earlier
+        build is removed. Items are externalized a shard at a time.
+        """
+        tmp = directory + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        manifest = {'Shards': {},
+                    'Sections': {},
+                    'AssessmentItems': {}}
+        for name, ntiid, shard in self._shards(section):
+            path = os.path.join(tmp, name)
+            self._prepare_items(shard)
+            try:
+                self._stream_index(shard, path, whole=False)
+            finally:
+                self._prepared = None
+            manifest['Shards'][name] = dict(file_entry(path), NTIID=ntiid)
+            if shard.sections:
+                for child in self._section_ntiids(shard.sections[0]):
+                    manifest['Sections'][child] = name
+            elif ntiid:
+                manifest['Sections'][ntiid] = name
+            for item in self._iter_items(shard):
+                manifest['AssessmentItems'][item.ntiid] = name
+        self._write_solutions(os.path.dirname(directory))
+        manifest['Metadata'] = self._index_metadata()
+        write_manifest(tmp, manifest)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp, directory)
+        outpath = os.path.dirname(directory)
+        for name in (INDEX_NAME, INDEX_NAME + COMPRESSED_SUFFIX, OFFSETS_NAME):
+            path = os.path.join(outpath, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _externalize_item(self, element):
+        """
+        Return the externalized form of the assessment ``element``,
+        from the item cache when its source is unchanged.
+        """
+        count('items')
+        key = None
+        if self._cache is not None:
+            key = element_digest(element)
+            ext_obj = self._cache.get(key)
+            if ext_obj is not None:
+                if self._report is not None:
+                    self._report.record(element, ext_obj)
+                return ext_obj
+
+        start = default_timer()
+        int_obj = element.assessment_object()
+        constructed = default_timer()
+        verify = self._should_verify(int_obj)
+        ext_obj = self._finish_item(element, int_obj, verify)
+        if self._report is not None:
+            self._report.record(element, ext_obj,
+                                construct=constructed - start,
+                                externalize=default_timer() - constructed)
+        if key is not None:
+            self._cache.set(key, ext_obj)
+        self._release_objects(element)
+        return ext_obj
+
+    def _release_objects(self, element):
+        """
+        Note that ``element``, and the elements it refers to, have been
+        externalized, releasing the assessment objects of the elements
+        that fall out of the :attr:`object_cache_size` most recent.
+        """
+        size = self.object_cache_size
+        if size < 0 or self._held is None:
+            return
+        held = self._held
+        # Building ``element`` built (or rebuilt) the objects of those
+        for node in itertools.chain(referenced_elements(element), (element,)):
+            held.pop(id(node), None)
+            held[id(node)] = node
+        while len(held) > size:
+            _, oldest = held.popitem(last=False)
+            count('objects_released', release_assessment_objects(oldest))
+
+    def _finish_item(self, element, int_obj, verify):
+        ext_obj = self._to_external_object(int_obj)
+        # Verify that we can round-trip this object
+        if verify:
+            self._ensure_roundtrips(int_obj, ext_obj, provenance=element)
+        return ext_obj
+
+    def _parallel(self):
+        if self.processes < 2:
+            return False
+        if futures is None or _fork_context() is None:  # pragma: no cover
+            logger.warning("Cannot fork worker processes; externalizing serially")
+            return False
+        return True
+
+    def _externalize_items(self, elements):
+        """
+        Return the externalized forms of the assessment ``elements``, in
+        the same order.
+        """
+        if self._prepared is not None:
+            return [self._prepared[id(x)] for x in elements]
+        if len(elements) > 1 and self._forking:
+            return self._externalize_in_pool(elements)
+        return [self._externalize_item(x) for x in elements]
+
+    def _externalize_in_pool(self, elements):
+        """
+        Construct the objects for ``elements`` here, to choose which to
+        verify, then fork workers that externalize and verify them. Jobs
+        are dispatched and merged in NTIID order, so verification
+        choices, cache writes and the reported failure do not depend on
+        scheduling.
+        """
+        results = {}
+        constructed = {}
+        jobs = []
+        count('items', len(elements))
+        for element in sorted(elements, key=lambda x: x.ntiid):
+            key = None
+            if self._cache is not None:
+                key = element_digest(element)
+                ext_obj = self._cache.get(key)
+                if ext_obj is not None:
+                    if self._report is not None:
+                        self._report.record(element, ext_obj)
+                    results[id(element)] = ext_obj
+                    continue
+            start = default_timer()
+            int_obj = element.assessment_object()
+            constructed[id(element)] = default_timer() - start
+            jobs.append((element, int_obj, self._should_verify(int_obj), key))
+
+        if jobs:
+            outcomes = self._fork_workers(jobs)
+            for (element, _, _, key), (ext_obj, error) in zip(jobs, outcomes):
+                if error is not None:
+                    error, formatted = error
+                    __traceback_info__ = element.ntiid, element, formatted
+                    if error is None:  # pragma: no cover
+                        raise ValueError("Failed to externalize assessment object "
+                                         "in worker process", element.ntiid,
+                                         formatted)
+                    raise error
+                # Each job externalized once, in the worker
+                self.externalizations += 1
+                count('externalizations')
+                if key is not None:
+                    self._cache.set(key, ext_obj)
+                if self._report is not None:
+                    self._report.record(element, ext_obj,
+                                        construct=constructed[id(element)])
+                results[id(element)] = ext_obj
+                self._release_objects(element)
+        return [results[id(x)] for x in elements]
+
+    def _fork_workers(self, jobs):
+        """
+        Fork a pool of :attr:`processes` workers sharing the elements and
+        objects of the ``(element, int_obj, verify, key)`` ``jobs``, and
+        return the ``(ext_obj, error)`` of each, in order. The pool is
+        shut down before returning.
+        """
+        global _worker_state
+        work = [(index, verify) for index, (_, _, verify, _) in enumerate(jobs)]
+        size = max(1, len(work) // (self.processes * 4))
+        chunks = [work[start:start + size]
+                  for start in range(0, len(work), size)]
+        _worker_state = (self,
+                         [element for element, _, _, _ in jobs],
+                         [int_obj for _, int_obj, _, _ in jobs])
+        pool = _process_pool(min(self.processes, len(chunks)))
+        try:
+            return list(itertools.chain.from_iterable(
+                pool.map(_externalize_in_worker, chunks)))
+        finally:
+            pool.shutdown()
+            _worker_state = None
+
+    def _should_verify(self, assm_obj):
+        """
+        Whether the :attr:`verification` policy calls for a round-trip
+        check of ``assm_obj``.
+        """
+        policy = self.verification
+        if policy == VERIFY_SAMPLED:
+            return _ntiid_fraction(assm_obj.ntiid) < self.verification_sample
+        if policy == VERIFY_TYPES:
+            kind = type(assm_obj)
+            if kind in self._verified_types:
+                return False
+            self._verified_types.add(kind)
+            return True
+        return policy == VERIFY_FULL
+
+    @timed_method('ensure_roundtrips')
+    def _ensure_roundtrips(self, assm_obj, ext_obj=None, provenance=None):
         # No need to go into its children, like parts.
-        ext_obj = self._to_external_object(assm_obj)
+        if ext_obj is None:
+            ext_obj = self._to_external_object(assm_obj)
         __traceback_info__ = provenance, assm_obj, ext_obj
 
         # Use the class of the object returned as a factory.
+        # The internalization process mutates what it is given, so it
+        # works on a copy and ext_obj stays usable by the caller.
         raw_int_obj = type(assm_obj)()
         update_from_external_object(raw_int_obj,
-                                    ext_obj,
+                                    _copy_external(ext_obj),
                                     require_updater=True,
                                     notify=False)
 
         # Also be sure factories can be found
-        factory = find_factory_for(self._to_external_object(assm_obj))
+        factory = find_factory_for(ext_obj)
         assert factory is not None
-        # The ext_obj was mutated by the internalization process,
-        # so we need to externalize again. Or run a deep copy (?)
 
     def _is_uninteresting(self, element):
         """
         Uninteresting elements do not get an entry in the index. These are
         elements that have no children and no assessment items of their own.
         """
-
-        cache_attr = '@assessment_extractor_uninteresting'
-        if getattr(element, cache_attr, None) is not None:
-            return getattr(element, cache_attr)
+        # Normally answered from the marks left by the extraction engine
+        if getattr(element, UNINTERESTING_ATTR, None) is not None:
+            return getattr(element, UNINTERESTING_ATTR)
 
         boring = False
         if callable(getattr(element, 'assessment_object', None)):
@@ -183,8 +1100,5 @@ class _AssessmentExtractor(object):
         elif all((self._is_uninteresting(x) for x in element.childNodes)):
             boring = True
 
-        try:
-            setattr(element, cache_attr, boring)
-        except AttributeError:
-            pass
+        mark_uninteresting(element, boring)
         return boring
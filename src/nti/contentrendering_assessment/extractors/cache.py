@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+An on-disk cache of externalized assessment items, used to make
+rebuilds of large books proportional to the size of the edit.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import codecs
+import hashlib
+import tempfile
+
+import simplejson as json
+
+import pkg_resources
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The distributions whose versions affect the externalized form of an item
+VERSIONED_DISTRIBUTIONS = ('nti.contentrendering_assessment',
+                           'nti.assessment',
+                           'nti.externalization')
+
+
+def _distribution_version(name):
+    try:
+        return pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:  # pragma: no cover
+        return u''
+
+
+def _versions():
+    return tuple(_distribution_version(x) for x in VERSIONED_DISTRIBUTIONS)
+
+
+def _encode(value):
+    if not isinstance(value, bytes):
+        value = (u'%s' % (value,)).encode('utf-8')
+    return value
+
+
+def _assessment_targets(node):
+    """
+    Yield the assessment elements that ``node`` refers to by
+    ``\\naquestionref``, ``\\napollref``, assignment part ``idref`` and
+    the like.
+    """
+    idref = getattr(node, 'idref', None) or {}
+    for target in idref.values():
+        if callable(getattr(target, 'assessment_object', None)):
+            yield target
+
+
+def referenced_elements(element):
+    """
+    Yield, once each, the assessment elements that ``element`` or its
+    descendants refer to, and those they refer to in turn.
+    """
+    seen = set([id(element)])
+    pending = [element]
+    while pending:
+        node = pending.pop()
+        for child in [node] + list(node.allChildNodes):
+            for target in _assessment_targets(child):
+                if id(target) not in seen:
+                    seen.add(id(target))
+                    pending.append(target)
+                    yield target
+
+
+def _rendered_content(node):
+    """
+    The content of ``node`` as rendered, which rendering stores in place
+    of its source content (see ``_LocalContentMixin``), or ``None``.
+    Looked up directly so that it is never rendered here.
+    """
+    return getattr(node, '__dict__', {}).get('_asm_local_content')
+
+
+def element_digest(element):
+    """
+    Return a hex digest identifying the externalized form of the
+    assessment ``element``, from everything that reaches it: the source
+    of the document preamble (its macros), the NTIID, TeX source, title
+    (which may be inherited from an enclosing section) and the rendered
+    content of the element and its descendants (with resolved
+    references and resource paths), the same for every assessment
+    object it (transitively) references, the document timezone and the
+    versions of the packages that do the externalization.
+    """
+    hasher = hashlib.sha1()
+
+    def update(value):
+        hasher.update(b'\0')
+        hasher.update(_encode(value))
+
+    for version in _versions():
+        update(version)
+    document = getattr(element, 'ownerDocument', None)
+    userdata = getattr(document, 'userdata', None) or {}
+    update(userdata.get('document_timezone_name'))
+    update(getattr(getattr(document, 'preamble', None), 'source', None))
+
+    seen = set()
+    pending = [element]
+    while pending:
+        node = pending.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        update(getattr(node, 'ntiid', None))
+        update(node.source)
+        title = getattr(node, '_asm_title', None)
+        if callable(title):
+            update(title())
+        for child in [node] + list(node.allChildNodes):
+            update(_rendered_content(child))
+            pending.extend(_assessment_targets(child))
+    return hasher.hexdigest()
+
+
+class AssessmentItemCache(object):
+    """
+    Externalized assessment items stored as one JSON file per digest
+    (see :func:`element_digest`) beneath ``directory``. Only misses are
+    written, so the cost of a rebuild follows the number of changed
+    items.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        try:
+            with codecs.open(self._path(key), 'r', encoding='utf-8') as fp:
+                result = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def set(self, key, ext_obj):
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # Write to a temporary file first so an interrupted build can
+        # never leave a truncated entry behind.
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with codecs.getwriter('utf-8')(os.fdopen(fd, 'wb')) as fp:
+            json.dump(ext_obj, fp, sort_keys=True, ensure_ascii=True)
+        os.rename(tmp, path)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The canonical JSON form of externalized objects, and digests of it.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import hashlib
+
+import simplejson as json
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The key of the digest of an item, and of the whole index in its
+#: ``Metadata``
+CONTENT_DIGEST = 'ContentDigest'
+
+#: Keys that change on every build of the same content, left out of
+#: :func:`content_digest`
+VOLATILE_KEYS = frozenset(('CreatedTime', 'Last Modified',
+                           'publishLastModified'))
+
+
+def canonical_json(ext_obj):
+    """
+    ``ext_obj`` as compact, ASCII JSON with sorted keys.
+    """
+    return json.dumps(ext_obj, sort_keys=True, ensure_ascii=True,
+                      separators=(',', ':'))
+
+
+def text_digest(text):
+    """
+    The hex SHA-256 digest of the ASCII ``text``.
+    """
+    return hashlib.sha256(text.encode('ascii')).hexdigest()
+
+
+def stable(ext_obj):
+    """
+    A copy of ``ext_obj`` without :data:`VOLATILE_KEYS` or a
+    :data:`CONTENT_DIGEST`, at any depth, so that an item digests the
+    same before and after it is given its own.
+    """
+    if isinstance(ext_obj, dict):
+        return {k: stable(v) for k, v in ext_obj.items()
+                if k not in VOLATILE_KEYS and k != CONTENT_DIGEST}
+    if isinstance(ext_obj, (list, tuple)):
+        return [stable(x) for x in ext_obj]
+    return ext_obj
+
+
+def pinned(ext_obj, when):
+    """
+    A copy of ``ext_obj`` with the :data:`VOLATILE_KEYS` it has, at any
+    depth, set to ``when``.
+    """
+    if isinstance(ext_obj, dict):
+        return {k: when if k in VOLATILE_KEYS else pinned(v, when)
+                for k, v in ext_obj.items()}
+    if isinstance(ext_obj, (list, tuple)):
+        return [pinned(x, when) for x in ext_obj]
+    return ext_obj
+
+
+def source_date_epoch():
+    """
+    The time reproducible output is pinned to: ``SOURCE_DATE_EPOCH``
+    from the environment, or 0.
+    """
+    return float(os.environ.get('SOURCE_DATE_EPOCH') or 0)
+
+
+def content_digest(ext_obj):
+    """
+    The :func:`text_digest` of the :func:`stable` form of ``ext_obj``
+    as :func:`canonical_json`; the same for the same content on every
+    build.
+    """
+    return text_digest(canonical_json(stable(ext_obj)))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+An SQLite copy of the assessment index, ``assessment_index.sqlite``,
+for tools that query or load items in bulk.
+
+``sections`` has a row per named section of the index, with its
+``ntiid``, ``filename``, ``href`` and the NTIID of its ``parent``.
+``items`` has a row per item, with its ``ntiid``, ``mimetype``, the
+NTIID of its ``section``, the item as written in the index as
+canonical JSON (``json``) and its ``digest`` (see
+:func:`~.canonical.content_digest`).
+``metadata`` holds the index ``Metadata``, as JSON values.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sqlite3
+
+import simplejson as json
+
+from nti.contentrendering_assessment.extractors.canonical import canonical_json
+from nti.contentrendering_assessment.extractors.canonical import content_digest
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the database written next to ``assessment_index.json``
+DATABASE_NAME = 'assessment_index.sqlite'
+
+SCHEMA = (
+    """CREATE TABLE sections (
+        ntiid TEXT PRIMARY KEY,
+        filename TEXT,
+        href TEXT,
+        parent TEXT)""",
+    """CREATE TABLE items (
+        ntiid TEXT PRIMARY KEY,
+        mimetype TEXT,
+        section TEXT,
+        json TEXT NOT NULL,
+        digest TEXT NOT NULL)""",
+    """CREATE TABLE metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT)""",
+    "CREATE INDEX sections_parent ON sections (parent)",
+    "CREATE INDEX items_mimetype ON items (mimetype)",
+    "CREATE INDEX items_section ON items (section)",
+)
+
+
+class IndexDatabase(object):
+    """
+    Builds ``assessment_index.sqlite`` at ``path``. Rows go to a
+    temporary file in a single transaction; :meth:`close` commits and
+    moves it into place, :meth:`abort` discards it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = path + '.tmp'
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+        self._connection = sqlite3.connect(self._tmp)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+    def add_section(self, ntiid, filename, href, parent=None):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?)",
+            (ntiid, filename, href, parent))
+
+    def add_items(self, section, items):
+        """
+        Add the externalized ``items``, a mapping from NTIID, of the
+        section with the NTIID ``section``.
+        """
+        rows = []
+        for ntiid, ext_obj in items.items():
+            rows.append((ntiid, ext_obj.get('MimeType'), section,
+                         canonical_json(ext_obj), content_digest(ext_obj)))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)", rows)
+
+    def set_metadata(self, metadata):
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            ((k, json.dumps(v, sort_keys=True)) for k, v in metadata.items()))
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+        os.rename(self._tmp, self.path)
+
+    def abort(self):
+        self._connection.close()
+        os.remove(self._tmp)
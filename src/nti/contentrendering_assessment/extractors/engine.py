@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A single traversal of a rendered book, shared by the assessment
+extractors.
+
+The assessment, lesson question set and lesson survey extractors run
+one after the other over the same, by then unchanging, document. Rather
+than have each walk it, an :class:`ExtractionEngine` visits every node
+once and dispatches it to the visitor plugins that build what they all
+need: the tag index and the skeleton of the assessment index.
+
+The registered extractors run as one extraction run: the first,
+``000.ExtractionRunExtractor``, begins it and the last,
+``999.TOCSaveExtractor``, ends it. The engine built by the first
+extractor to need it is kept for the rest of the run and released when
+it ends, so the tag index does not keep the document's nodes alive
+afterwards. An extractor used on its own, outside a run, builds an
+engine that lives only as long as its :func:`extraction_engine` block.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import contextlib
+
+from zope import component
+from zope import interface
+
+from nti.contentrendering.interfaces import IRenderedBook
+
+from nti.contentrendering_assessment.tagindex import TagIndex
+from nti.contentrendering_assessment.tagindex import traverse
+from nti.contentrendering_assessment.tagindex import tag_index
+
+from nti.contentrendering_assessment.instrumentation import count
+from nti.contentrendering_assessment.instrumentation import timed
+from nti.contentrendering_assessment.instrumentation import visited
+
+from nti.contentrendering_assessment.interfaces import IExtractionRunExtractor
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The key of the engine in the document's ``userdata``
+ENGINE_KEY = 'nti_assessment_extraction_engine'
+
+#: The key marking an extraction run in the document's ``userdata``
+RUN_KEY = 'nti_assessment_extraction_run'
+
+#: The attribute caching whether an element is uninteresting to the
+#: assessment index
+UNINTERESTING_ATTR = '@assessment_extractor_uninteresting'
+
+
+def mark_uninteresting(element, boring):
+    try:
+        setattr(element, UNINTERESTING_ATTR, boring)
+    except AttributeError:
+        pass
+
+
+def is_assessment_element(element):
+    return callable(getattr(element, 'assessment_object', None))
+
+
+class _IndexSection(object):
+    """
+    A section of the assessment index as found in the DOM, before any of
+    its items have been externalized.
+    """
+
+    __slots__ = ('element', 'ntiid', 'items', 'sections')
+
+    def __init__(self, element):
+        self.element = element
+        self.ntiid = getattr(element, 'ntiid', None) or None
+        #: The assessment elements of this section, in document order
+        self.items = []
+        #: The named child sections, or ``None`` when there is no ``Items``
+        self.sections = None
+
+    def pruned(self, items, sections):
+        """
+        A copy of this section with only the given ``items`` and
+        ``sections``.
+        """
+        result = _IndexSection(self.element)
+        result.ntiid = self.ntiid
+        result.items = items
+        result.sections = sections
+        return result
+
+
+class _Fragment(object):
+    """
+    What the children of a node contribute to the enclosing section.
+    """
+
+    __slots__ = ('items', 'sections', 'containers', 'interesting')
+
+    def __init__(self):
+        self.items = []
+        self.sections = None
+        #: Uninteresting children that have children of their own
+        self.containers = []
+        self.interesting = False
+
+
+class IndexSkeletonVisitor(object):
+    """
+    Builds the :class:`_IndexSection` tree of the first ``document``
+    element as its nodes are exited, and records for every node whether
+    it is uninteresting to the index.
+
+    Sections are formed exactly as a recursive descent from the
+    ``document`` would form them: assessment elements belong to the
+    nearest enclosing node with an NTIID, and such nodes become child
+    sections when they contain any assessment element.
+    """
+
+    def __init__(self):
+        #: The ``document`` element
+        self.root = None
+        #: Its section, once traversed
+        self.section = None
+        self._fragments = []
+
+    def enter(self, node):
+        if self.root is None and self._fragments and node.nodeName == 'document':
+            self.root = node
+        self._fragments.append(_Fragment())
+
+    def exit(self, node):
+        fragment = self._fragments.pop()
+        item = is_assessment_element(node)
+        boring = not item and not fragment.interesting
+        mark_uninteresting(node, boring)
+        if not item and (not boring or node is self.root):
+            # A child with content and an NTIID still gets an (empty)
+            # container. NTIIDs are only asked of the children of nodes
+            # that are part of the index.
+            if      fragment.sections is None \
+                and any(getattr(x, 'ntiid', None) for x in fragment.containers):
+                fragment.sections = []
+        if node is self.root:
+            self.section = self._section(node, fragment)
+        if not self._fragments:
+            return
+
+        parent = self._fragments[-1]
+        if item:
+            # assessment_objects are leafs, never have children to worry
+            # about
+            parent.items.append(node)
+            parent.interesting = True
+        elif not node.hasChildNodes():
+            pass
+        elif boring:
+            parent.containers.append(node)
+        elif getattr(node, 'ntiid', None):
+            if parent.sections is None:
+                parent.sections = []
+            parent.sections.append(self._section(node, fragment))
+            parent.interesting = True
+        else:
+            # Without an ntiid it's not a section-level element, it's a
+            # paragraph or something like it. Thus we collapse into the
+            # parent.
+            parent.items.extend(fragment.items)
+            if fragment.sections is not None:
+                if parent.sections is None:
+                    parent.sections = []
+                parent.sections.extend(fragment.sections)
+            parent.interesting = True
+
+    @staticmethod
+    def _section(node, fragment):
+        section = _IndexSection(node)
+        section.items = fragment.items
+        section.sections = fragment.sections
+        return section
+
+
+class ExtractionEngine(object):
+    """
+    The results of visiting every node of ``document`` once.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.tag_index = TagIndex()
+        self.skeleton = IndexSkeletonVisitor()
+        traverse(document, (self.tag_index, self.skeleton))
+
+    @property
+    def index_section(self):
+        """
+        The :class:`_IndexSection` of the ``document`` element, or
+        ``None`` if there is none.
+        """
+        return self.skeleton.section
+
+    def getElementsByTagName(self, tagName):
+        return self.tag_index.getElementsByTagName(tagName)
+
+    def installed(self):
+        """
+        A context manager installing the tag index on the document, so
+        that assessment elements find their parts through it.
+        """
+        return tag_index(self.document, self.tag_index)
+
+
+def begin_run(book):
+    """
+    Begin an extraction run over ``book``: until :func:`end_run`, the
+    extractors share one engine.
+    """
+    book.document.userdata[RUN_KEY] = True
+
+
+def end_run(book):
+    """
+    End the extraction run over ``book``, releasing its engine.
+    """
+    userdata = book.document.userdata
+    userdata.pop(RUN_KEY, None)
+    userdata.pop(ENGINE_KEY, None)
+
+
+def in_run(book):
+    """
+    Whether an extraction run over ``book`` has begun and not ended.
+    """
+    return bool(book.document.userdata.get(RUN_KEY))
+
+
+@contextlib.contextmanager
+def extraction_engine(book):
+    """
+    A context manager providing the :class:`ExtractionEngine` for the
+    document of ``book``. The engine of the extraction run or of an
+    enclosing block is shared; one created here outside a run is
+    discarded when the block exits.
+    """
+    userdata = book.document.userdata
+    engine = userdata.get(ENGINE_KEY)
+    if engine is not None and engine.document is book.document:
+        yield engine
+        return
+    with timed('engine'):
+        engine = userdata[ENGINE_KEY] = ExtractionEngine(book.document)
+    count('dom_nodes_visited', len(engine.tag_index))
+    visited(len(engine.tag_index))
+    try:
+        yield engine
+    finally:
+        if not in_run(book) and userdata.get(ENGINE_KEY) is engine:
+            del userdata[ENGINE_KEY]
+
+
+@component.adapter(IRenderedBook)
+@interface.implementer(IExtractionRunExtractor)
+class _ExtractionRunExtractor(object):
+    """
+    Runs first: begins the extraction run that ``999.TOCSaveExtractor``
+    ends.
+    """
+
+    def __init__(self, book=None):
+        pass
+
+    def transform(self, book, savetoc=True, outpath=None):
+        begin_run(book)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The items of the assessment index as newline-delimited JSON,
+``assessment_items.ndjson``, for bulk loading without rebuilding the
+index tree.
+
+Each line is an object with the ``NTIID`` of an item, the ``Item`` as
+written in the index, and the ``Section`` NTIID, ``filename`` and
+``href`` of the section containing it (``null`` for items of an
+unnamed root). Items are written a section at a time, in the order the
+index is written, and in NTIID order within a section.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import codecs
+
+from nti.contentrendering_assessment.extractors.canonical import canonical_json
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the file written next to ``assessment_index.json``
+NDJSON_NAME = 'assessment_items.ndjson'
+
+
+class ItemLinesWriter(object):
+    """
+    Writes ``assessment_items.ndjson`` at ``path``, by way of a
+    temporary file that :meth:`close` moves into place and
+    :meth:`abort` discards.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = path + '.tmp'
+        self._fp = codecs.open(self._tmp, 'w', encoding='utf-8')
+
+    def add_items(self, header, items):
+        """
+        Write a line for each of the externalized ``items``, a mapping
+        from NTIID, of the section with the given ``header`` (its
+        ``NTIID``, ``filename`` and ``href``).
+        """
+        for ntiid, ext_obj in sorted(items.items()):
+            line = {'NTIID': ntiid,
+                    'Item': ext_obj,
+                    'Section': header.get('NTIID'),
+                    'filename': header.get('filename'),
+                    'href': header.get('href')}
+            self._fp.write(canonical_json(line))
+            self._fp.write('\n')
+
+    def close(self):
+        self._fp.close()
+        os.rename(self._tmp, self.path)
+
+    def abort(self):
+        self._fp.close()
+        os.remove(self._tmp)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The normalized form of the assessment index.
+
+In the default, nested, form each item carries full copies of the
+questions, question sets and polls it contains, so a question in a set
+that is also part of an assignment is written three times. In the
+normalized form every item of the index is written once, and the items
+containing it refer to it by NTIID with an ``AssessmentItemRef``::
+
+    {"Class": "AssessmentItemRef", "Target-NTIID": "tag:..."}
+
+Objects that are not items of the index themselves (parts, or items
+that had no place in the index) are still embedded. A normalized index
+records ``"format": "normalized"`` in its ``Metadata``; an index without
+a ``format`` is nested.
+:func:`denormalize_index` turns a normalized index back into the nested
+form.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import codecs
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+import simplejson as json
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Index formats: each item embeds what it contains, or refers to the
+#: other items of the index by NTIID
+INDEX_NESTED = 'nested'
+INDEX_NORMALIZED = 'normalized'
+INDEX_FORMATS = (INDEX_NESTED, INDEX_NORMALIZED)
+
+#: The class of the objects standing in for referenced items
+ITEM_REF_CLASS = 'AssessmentItemRef'
+
+#: The key of the NTIID an ``AssessmentItemRef`` refers to
+TARGET_NTIID = 'Target-NTIID'
+
+
+def item_ref(ntiid):
+    return {'Class': ITEM_REF_CLASS, TARGET_NTIID: ntiid}
+
+
+def is_item_ref(ext_obj):
+    return isinstance(ext_obj, Mapping) and ext_obj.get('Class') == ITEM_REF_CLASS
+
+
+def _replace(ext_obj, replacement):
+    """
+    Copy ``ext_obj``, substituting the mappings for which
+    ``replacement`` returns something other than ``None``.
+    """
+    if isinstance(ext_obj, Mapping):
+        result = replacement(ext_obj)
+        if result is not None:
+            return result
+        return {k: _replace(v, replacement) for k, v in ext_obj.items()}
+    if isinstance(ext_obj, (list, tuple)):
+        return [_replace(x, replacement) for x in ext_obj]
+    return ext_obj
+
+
+def normalize_item(ext_obj, ntiids):
+    """
+    A copy of the externalized item ``ext_obj`` in which the objects it
+    contains whose NTIID is one of ``ntiids`` are replaced by
+    ``AssessmentItemRef`` objects. ``ext_obj`` is unchanged.
+    """
+    def replacement(value):
+        ntiid = value.get('NTIID')
+        if ntiid in ntiids:
+            return item_ref(ntiid)
+        return None
+    return {k: _replace(v, replacement) for k, v in ext_obj.items()}
+
+
+def iter_index_items(index):
+    """
+    Yield ``(ntiid, item)`` for every item of an assessment ``index``,
+    in any form.
+    """
+    sections = [index]
+    while sections:
+        section = sections.pop()
+        for ntiid, item in (section.get('AssessmentItems') or {}).items():
+            yield ntiid, item
+        sections.extend((section.get('Items') or {}).values())
+
+
+def denormalize_index(index):
+    """
+    Return a copy of the assessment ``index`` in the nested form, with
+    every ``AssessmentItemRef`` replaced by the item it refers to; an
+    item referred to several times is one shared object. A nested index
+    is returned as is.
+    """
+    metadata = index.get('Metadata') or {}
+    if metadata.get('format') != INDEX_NORMALIZED:
+        return index
+
+    items = dict(iter_index_items(index))
+    resolved = {}
+
+    def resolve(ntiid):
+        if ntiid not in resolved:
+            try:
+                item = items[ntiid]
+            except KeyError:
+                raise ValueError("Unknown assessment item reference", ntiid)
+            resolved[ntiid] = None  # cycle guard
+            resolved[ntiid] = {k: _replace(v, replacement)
+                               for k, v in item.items()}
+        result = resolved[ntiid]
+        if result is None:
+            raise ValueError("Circular assessment item reference", ntiid)
+        return result
+
+    def replacement(value):
+        if is_item_ref(value):
+            return resolve(value[TARGET_NTIID])
+        return None
+
+    def section(entry):
+        result = dict(entry)
+        if 'AssessmentItems' in entry:
+            result['AssessmentItems'] = dict((k, resolve(k))
+                                             for k in entry['AssessmentItems'])
+        if 'Items' in entry:
+            result['Items'] = dict((k, section(v))
+                                   for k, v in entry['Items'].items())
+        return result
+
+    result = section(index)
+    metadata = dict(metadata)
+    metadata.pop('format')
+    result['Metadata'] = metadata
+    return result
+
+
+def load_index(path):
+    """
+    Read the ``assessment_index.json`` at ``path``, in the nested form
+    whatever form it was written in.
+    """
+    with codecs.open(path, 'r', encoding='utf-8') as fp:
+        index = json.load(fp)
+    return denormalize_index(index)
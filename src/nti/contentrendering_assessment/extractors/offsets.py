@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Random access to the sections and items of ``assessment_index.json``.
+
+When asked to, the assessment extractor records where in the index the
+value of each section and item NTIID was written, in
+``assessment_index_offsets.json``::
+
+    Offsets => { # Keyed by section or item NTIID
+            [offset, length] # In bytes, within the index
+    }
+    size => int # The size of the index they were recorded for
+
+:class:`AssessmentIndexReader` uses these to decode single entries of
+a memory-mapped index without parsing the rest of it.
+
+A build that writes the index without offsets removes the file.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import mmap
+import codecs
+
+import simplejson as json
+
+from nti.contentrendering_assessment.extractors.writer import output_file
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the offsets file written next to ``assessment_index.json``
+OFFSETS_NAME = 'assessment_index_offsets.json'
+
+
+def write_offsets(path, offsets, size):
+    data = {'Offsets': offsets, 'size': size}
+    with output_file(path) as fp:
+        json.dump(data, fp, indent='\t', sort_keys=True, ensure_ascii=True)
+
+
+class AssessmentIndexReader(object):
+    """
+    Reads single sections and items, by NTIID, from an
+    ``assessment_index.json`` written with offsets. The index is
+    memory-mapped, and each entry is decoded when it is asked for.
+
+    Items are returned as written; in a normalized index they hold
+    ``AssessmentItemRef`` objects (see :mod:`.normalized`).
+    """
+
+    def __init__(self, path, offsets_path=None):
+        if offsets_path is None:
+            offsets_path = os.path.join(os.path.dirname(path), OFFSETS_NAME)
+        with codecs.open(offsets_path, 'r', encoding='utf-8') as fp:
+            data = json.load(fp)
+        self.offsets = data['Offsets']
+        self._fp = open(path, 'rb')
+        try:
+            size = os.fstat(self._fp.fileno()).st_size
+            if size != data['size']:
+                raise ValueError("Offsets do not match the index", path)
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._fp.close()
+            raise
+
+    def __contains__(self, ntiid):
+        return ntiid in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, ntiid):
+        offset, length = self.offsets[ntiid]
+        return json.loads(self._map[offset:offset + length].decode('utf-8'))
+
+    def get(self, ntiid, default=None):
+        if ntiid not in self.offsets:
+            return default
+        return self[ntiid]
+
+    def close(self):
+        self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *unused_args):
+        self.close()
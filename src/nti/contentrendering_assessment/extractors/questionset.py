@@ -14,12 +14,27 @@ import six
 from zope import component
 from zope import interface
 
+from paste.deploy.converters import asbool
+
 from plasTeX.Renderers import render_children
 
 from nti.contentrendering.interfaces import IRenderedBook
 
+from nti.contentrendering_assessment.extractors.engine import in_run
+from nti.contentrendering_assessment.extractors.engine import extraction_engine
+
+from nti.contentrendering_assessment.extractors.toc import save_toc
+from nti.contentrendering_assessment.extractors.toc import TOCAncestors
+from nti.contentrendering_assessment.extractors.toc import is_course_toc
+from nti.contentrendering_assessment.extractors.toc import get_topic_map
+from nti.contentrendering_assessment.extractors.toc import record_toc_mutation
+
+from nti.contentrendering_assessment.instrumentation import instrumenting
+
 from nti.contentrendering_assessment.interfaces import ILessonQuestionSetExtractor
 
+from nti.contentrendering_assessment.utils import apply_options
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -27,61 +42,81 @@ logger = __import__('logging').getLogger(__name__)
 @interface.implementer(ILessonQuestionSetExtractor)
 class _LessonQuestionSetExtractor(object):
 
-    def __init__(self, book=None):
-        pass
+    #: If true and this extractor runs within an extraction run (see
+    #: :mod:`.engine`), the TOC is saved once by the final
+    #: ``999.TOCSaveExtractor`` rather than by this extractor. Run on
+    #: its own, the extractor always saves the TOC itself.
+    defer_toc_save = True
+
+    #: If true, timings and counters are added to
+    #: ``assessment_instrumentation.json``
+    instrument = False
+
+    #: If true, the DOM nodes visited by each call site are counted
+    #: into the instrumentation report (implies :attr:`instrument`)
+    traversals = False
+
+    #: Option names and the converters for their environment values
+    _options = {
+        'defer_toc_save': asbool,
+        'instrument': asbool,
+        'traversals': asbool,
+    }
+
+    def __init__(self, book=None, **kwargs):
+        apply_options(self, self._options, kwargs)
 
     def transform(self, book, savetoc=True, outpath=None):
         outpath = outpath or book.contentLocation
         outpath = os.path.expanduser(outpath)
+        with instrumenting(book, 'transform.LessonQuestionSetExtractor',
+                           self.instrument, outpath, self.traversals):
+            self._transform(book, savetoc)
 
+    def _transform(self, book, savetoc):
         found_sets = False
         dom = book.toc.dom
         topic_map = self._get_topic_map(dom)
-        assignment_els = book.document.getElementsByTagName('naassignment')
-        for tag_name in ('naquestionset', 'naquestionbank', 'narandomizedquestionset'):
-            questionset_els = book.document.getElementsByTagName(tag_name)
-            if questionset_els:
-                found_sets = True
-                self._process_questionsets(dom, questionset_els, topic_map)
+        ancestors = TOCAncestors(topic_map)
+        with extraction_engine(book) as engine, engine.installed():
+            assignment_els = engine.getElementsByTagName('naassignment')
+            for tag_name in ('naquestionset', 'naquestionbank', 'narandomizedquestionset'):
+                questionset_els = engine.getElementsByTagName(tag_name)
+                if questionset_els:
+                    found_sets = True
+                    self._process_questionsets(dom, questionset_els, topic_map,
+                                               ancestors)
 
         if found_sets:
-            self._process_assignments(dom, assignment_els, topic_map)
+            self._process_assignments(dom, assignment_els, topic_map, ancestors)
             if savetoc:
-                book.toc.save()
+                self._save_toc(book)
+
+    def _save_toc(self, book):
+        if self.defer_toc_save and in_run(book):
+            record_toc_mutation(book)
+        else:
+            save_toc(book.toc)
 
     def _get_topic_map(self, dom):
-        result = {}
-        for topic_el in dom.getElementsByTagName('topic'):
-            ntiid = topic_el.getAttribute('ntiid')
-            if ntiid:
-                result[ntiid] = topic_el
-        return result
-
-    def _process_questionsets(self, dom, els, topic_map):
+        return get_topic_map(dom)
+
+    def _process_questionsets(self, dom, els, topic_map, ancestors=None):
+        ancestors = TOCAncestors(topic_map) if ancestors is None else ancestors
+        is_course = is_course_toc(dom)
         for el in els:
             if not el.parentNode:
                 continue
             # Discover the nearest topic in the toc that is a 'course' node
-            lesson_el = None
-            parent_el = el.parentNode
-            if hasattr(parent_el, 'ntiid') and parent_el.tagName.startswith('course'):
-                lesson_el = topic_map.get(parent_el.ntiid)
-
-            while lesson_el is None and parent_el.parentNode is not None:
-                parent_el = parent_el.parentNode
-                if      hasattr(parent_el, 'ntiid') \
-                    and parent_el.tagName.startswith('course'):
-                    lesson_el = topic_map.get(parent_el.ntiid)
+            _, lesson_el = ancestors.lesson(el)
 
             # SAJ: Hack to prevent question set sections from appearing on
             # old style course overviews
-            title_el = el.parentNode
-            while (not hasattr(title_el, 'title')):
-                title_el = title_el.parentNode
+            title_el = ancestors.title_element(el)
 
             # If the title_el is a topic in the ToC of a course, suppress it.
-            if      dom.childNodes[0].getAttribute('isCourse') == 'true' \
-                and title_el.ntiid in topic_map.keys():
+            if      is_course and title_el is not None \
+                and title_el.ntiid in topic_map:
                 topic_map[title_el.ntiid].setAttribute('suppressed', 'true')
 
             title = el.title
@@ -95,7 +130,7 @@ class _LessonQuestionSetExtractor(object):
             toc_el.setAttribute('mimeType', el.mimeType)
             toc_el.setAttribute('target-ntiid', el.ntiid)
             toc_el.setAttribute('question-count', el.question_count)
-            if lesson_el:
+            if lesson_el is not None:
                 lesson_el.appendChild(toc_el)
                 lesson_el.appendChild(dom.createTextNode(u'\n'))
 
@@ -103,7 +138,9 @@ class _LessonQuestionSetExtractor(object):
     # 'suppressed'. In practice, this is only needed for 'no_submit' assignments
     # since they have no associated question set to otherwise trigger the marking.
     # This should move into its  own extractor, but for now it is here.
-    def _process_assignments(self, dom, els, topic_map):
+    def _process_assignments(self, dom, els, topic_map, ancestors=None):
+        ancestors = TOCAncestors(topic_map) if ancestors is None else ancestors
+        is_course = is_course_toc(dom)
         for el in els:
             if not el.parentNode:
                 continue
@@ -115,26 +152,15 @@ class _LessonQuestionSetExtractor(object):
                 continue
 
             # Discover the nearest topic in the toc that is a 'course' node
-            lesson_el = None
-            parent_el = el.parentNode
-            if hasattr(parent_el, 'ntiid') and parent_el.tagName.startswith('course'):
-                lesson_el = topic_map.get(parent_el.ntiid)
-
-            while lesson_el is None and parent_el.parentNode is not None:
-                parent_el = parent_el.parentNode
-                if     hasattr(parent_el, 'ntiid') \
-                    and parent_el.tagName.startswith('course'):
-                    lesson_el = topic_map.get(parent_el.ntiid)
+            _, lesson_el = ancestors.lesson(el)
 
             # SAJ: Hack to prevent no_submit assignment sections from appearing on
             # old style course overviews
-            title_el = el.parentNode
-            while not hasattr(title_el, 'title'):
-                title_el = title_el.parentNode
+            title_el = ancestors.title_element(el)
 
             # If the title_el is a topic in the ToC of a course, suppress it.
-            if      dom.childNodes[0].getAttribute('isCourse') == u'true' \
-                and title_el.ntiid in topic_map.keys():
+            if      is_course and title_el is not None \
+                and title_el.ntiid in topic_map:
                 topic_map[title_el.ntiid].setAttribute('suppressed', 'true')
 
             mimeType = 'application/vnd.nextthought.nanosubmitassignment'
@@ -143,6 +169,6 @@ class _LessonQuestionSetExtractor(object):
             toc_el.setAttribute('label', el.title)
             toc_el.setAttribute('mimeType', mimeType)
             toc_el.setAttribute('target-ntiid', el.ntiid)
-            if lesson_el:
+            if lesson_el is not None:
                 lesson_el.appendChild(toc_el)
                 lesson_el.appendChild(dom.createTextNode(u'\n'))
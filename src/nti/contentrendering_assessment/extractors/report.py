@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The size and cost of each item of the assessment index, checked
+against optional budgets.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import codecs
+
+import simplejson as json
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the report written next to ``assessment_index.json``
+REPORT_NAME = 'assessment_item_report.json'
+
+#: Budget actions: log a warning, or fail the build
+BUDGET_WARN = 'warn'
+BUDGET_FAIL = 'fail'
+BUDGET_ACTIONS = (BUDGET_WARN, BUDGET_FAIL)
+
+
+def external_size(ext_obj, indent=None, separators=None):
+    """
+    The size in bytes of ``ext_obj`` as ASCII JSON with sorted keys and
+    the given ``indent`` and ``separators``, as the index is written.
+    """
+    return len(json.dumps(ext_obj, sort_keys=True, ensure_ascii=True,
+                          indent=indent, separators=separators))
+
+
+def part_count(ext_obj):
+    """
+    The number of parts of an externalized question, poll or
+    assignment, or the number of questions of a question set or survey.
+    """
+    for key in ('parts', 'questions'):
+        value = ext_obj.get(key)
+        if value is not None:
+            return len(value)
+    return 0
+
+
+class ItemReport(object):
+    """
+    Records, by NTIID, the size, construction and externalization time
+    (and their sum, ``seconds``) and part count of assessment items.
+    The size, ``bytes``, is that of the item as written to the index,
+    once solutions are split from it, it is normalized and it has its
+    digest (see :meth:`measure`); ``None`` until then.
+
+    Times are ``None`` when they were not measured: all of them for
+    items taken from the item cache, and the externalization time of
+    items externalized in worker processes.
+    """
+
+    #: The keys of :attr:`items` entries that budgets apply to
+    BUDGETED = ('bytes', 'seconds', 'parts')
+
+    def __init__(self):
+        self.items = {}
+
+    def record(self, element, ext_obj, construct=None, externalize=None):
+        measured = [x for x in (construct, externalize) if x is not None]
+        self.items[element.ntiid] = {
+            'tag': getattr(element, 'tagName', None),
+            'bytes': None,
+            'construct': construct,
+            'externalize': externalize,
+            'seconds': sum(measured) if measured else None,
+            'parts': part_count(ext_obj),
+        }
+
+    def measure(self, ntiid, ext_obj, **kwargs):
+        """
+        Record the size of the item ``ntiid``, written to the index as
+        ``ext_obj`` with the :func:`external_size` ``kwargs``.
+        """
+        self.items[ntiid]['bytes'] = external_size(ext_obj, **kwargs)
+
+    def heaviest(self, n, key='bytes'):
+        """
+        The ``n`` NTIIDs with the largest ``key``, heaviest first.
+        """
+        ranked = sorted(self.items.items(),
+                        key=lambda x: (-(x[1][key] or 0), x[0]))
+        return [ntiid for ntiid, _ in ranked[:n]]
+
+    def violations(self, budgets):
+        """
+        ``(ntiid, key, value, budget)`` for every item exceeding one of
+        ``budgets``, a mapping from :attr:`BUDGETED` keys to their
+        maximums; ``None`` maximums are not checked.
+        """
+        result = []
+        for ntiid, entry in sorted(self.items.items()):
+            for key in self.BUDGETED:
+                budget = budgets.get(key)
+                value = entry[key]
+                if budget is not None and value is not None and value > budget:
+                    result.append((ntiid, key, value, budget))
+        return result
+
+    def write(self, path, top, budgets):
+        report = {'items': self.items,
+                  'heaviest': self.heaviest(top),
+                  'budgets': budgets,
+                  'violations': self.violations(budgets)}
+        with codecs.open(path, 'w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent='\t', sort_keys=True)
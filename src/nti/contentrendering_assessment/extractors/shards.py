@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The sharded form of the assessment index.
+
+Instead of one ``assessment_index.json``, the ``assessment_shards``
+directory holds one file per top-level section of the book, and one for
+the book itself with only its own items. Each shard is an index of
+its own, with the same structure as ``assessment_index.json``, holding
+only the path from the root to its section. ``manifest.json`` describes
+them::
+
+    Shards => { # Keyed by shard file name
+            NTIID => string # The NTIID of the section of the shard
+            sha256 => string # The hex digest of the file
+            size => int # Its size in bytes
+    }
+    Sections => { # Keyed by section NTIID
+            string # The shard file name
+    }
+    AssessmentItems => { # Keyed by item NTIID
+            string # The shard file name
+    }
+    Metadata => {...} # As in the index
+
+A build that is not sharded removes the directory.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import codecs
+import hashlib
+
+import simplejson as json
+
+from nti.contentrendering_assessment.extractors.writer import output_file
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The directory of the shards, next to where ``assessment_index.json``
+#: would be
+SHARDS_DIR = 'assessment_shards'
+
+#: The name of the manifest in :data:`SHARDS_DIR`
+MANIFEST_NAME = 'manifest.json'
+
+#: The name of the shard holding the items of the root section
+ROOT_SHARD = 'root.json'
+
+
+def shard_name(ntiid):
+    """
+    The file name of the shard of the top-level section ``ntiid``.
+    NTIIDs are hashed as they are not safe file names.
+    """
+    return hashlib.md5(ntiid.encode('utf-8')).hexdigest() + '.json'
+
+
+def file_entry(path):
+    """
+    The ``sha256`` digest and ``size`` of the file at ``path``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return {'sha256': digest.hexdigest(), 'size': size}
+
+
+def _load(path):
+    with codecs.open(path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with output_file(path) as fp:
+        json.dump(manifest, fp, indent='\t', sort_keys=True, ensure_ascii=True)
+
+
+def load_manifest(directory):
+    return _load(os.path.join(directory, MANIFEST_NAME))
+
+
+def load_shard(directory, ntiid, manifest=None):
+    """
+    The index of the shard in ``directory`` holding the section or item
+    ``ntiid``, or ``None`` if no shard does.
+    """
+    if manifest is None:
+        manifest = load_manifest(directory)
+    name = manifest['Sections'].get(ntiid) \
+        or manifest['AssessmentItems'].get(ntiid)
+    if name is None:
+        return None
+    return _load(os.path.join(directory, name))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Separates the answers of assessment items from their presentation.
+
+The solutions and explanations of the parts of each question (the
+objects in its ``parts``) are taken out of the externalized items and
+kept, by the NTIID of the question, for ``assessment_solutions.json``::
+
+    Items => { # Keyed by NTIID of the question
+            parts => [ # One entry per part, in order
+                    {solutions => [...], explanation => ...}
+            ]
+    }
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+import simplejson as json
+
+from nti.contentrendering_assessment.extractors.writer import output_file
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the solutions file written next to ``assessment_index.json``
+SOLUTIONS_NAME = 'assessment_solutions.json'
+
+#: The keys of externalized parts that hold answer data
+SOLUTION_KEYS = ('solutions', 'explanation')
+
+
+def _answers(part):
+    if not isinstance(part, Mapping):
+        return {}
+    return dict((k, part[k]) for k in SOLUTION_KEYS if k in part)
+
+
+def _strip(ext_obj, solutions, part=False):
+    if isinstance(ext_obj, Mapping):
+        result = {}
+        for key, value in ext_obj.items():
+            if part and key in SOLUTION_KEYS:
+                continue
+            if key == 'parts' and isinstance(value, (list, tuple)):
+                result[key] = [_strip(x, solutions, True) for x in value]
+            else:
+                result[key] = _strip(value, solutions)
+        ntiid = ext_obj.get('NTIID')
+        parts = ext_obj.get('parts')
+        if ntiid and isinstance(parts, (list, tuple)):
+            answers = [_answers(x) for x in parts]
+            if any(answers):
+                solutions[ntiid] = {'parts': answers}
+        return result
+    if isinstance(ext_obj, (list, tuple)):
+        return [_strip(x, solutions) for x in ext_obj]
+    return ext_obj
+
+
+def strip_solutions(ext_obj, solutions):
+    """
+    A copy of the externalized item ``ext_obj`` without the solutions or
+    explanations of its parts. Those of every question found in it, the
+    item itself or one it contains, are stored in the ``solutions``
+    mapping under the NTIID of the question. Other objects keep their
+    keys, and ``ext_obj`` is unchanged.
+    """
+    return _strip(ext_obj, solutions)
+
+
+def write_solutions(path, solutions, metadata=None):
+    """
+    Write the ``solutions`` gathered by :func:`strip_solutions` to
+    ``path``, replacing it only once complete.
+    """
+    data = {'Items': solutions}
+    if metadata is not None:
+        data['Metadata'] = metadata
+    with output_file(path) as fp:
+        json.dump(data, fp, indent='\t', sort_keys=True, ensure_ascii=True)
@@ -14,12 +14,26 @@ import six
 from zope import component
 from zope import interface
 
+from paste.deploy.converters import asbool
+
 from plasTeX.Renderers import render_children
 
 from nti.contentrendering.interfaces import IRenderedBook
 
+from nti.contentrendering_assessment.extractors.engine import in_run
+from nti.contentrendering_assessment.extractors.engine import extraction_engine
+
+from nti.contentrendering_assessment.extractors.toc import save_toc
+from nti.contentrendering_assessment.extractors.toc import TOCAncestors
+from nti.contentrendering_assessment.extractors.toc import get_topic_map
+from nti.contentrendering_assessment.extractors.toc import record_toc_mutation
+
+from nti.contentrendering_assessment.instrumentation import instrumenting
+
 from nti.contentrendering_assessment.interfaces import ILessonSurveyExtractor
 
+from nti.contentrendering_assessment.utils import apply_options
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -27,53 +41,76 @@ logger = __import__('logging').getLogger(__name__)
 @interface.implementer(ILessonSurveyExtractor)
 class _LessonSurveyExtractor(object):
 
-    def __init__(self, book=None):
-        pass
+    #: If true and this extractor runs within an extraction run (see
+    #: :mod:`.engine`), the TOC is saved once by the final
+    #: ``999.TOCSaveExtractor`` rather than by this extractor. Run on
+    #: its own, the extractor always saves the TOC itself.
+    defer_toc_save = True
+
+    #: If true, timings and counters are added to
+    #: ``assessment_instrumentation.json``
+    instrument = False
+
+    #: If true, the DOM nodes visited by each call site are counted
+    #: into the instrumentation report (implies :attr:`instrument`)
+    traversals = False
+
+    #: Option names and the converters for their environment values
+    _options = {
+        'defer_toc_save': asbool,
+        'instrument': asbool,
+        'traversals': asbool,
+    }
+
+    def __init__(self, book=None, **kwargs):
+        apply_options(self, self._options, kwargs)
 
     def transform(self, book, savetoc=True, outpath=None):
         outpath = outpath or book.contentLocation
         outpath = os.path.expanduser(outpath)
+        with instrumenting(book, 'transform.LessonSurveyExtractor',
+                           self.instrument, outpath, self.traversals):
+            self._transform(book, savetoc)
 
+    def _transform(self, book, savetoc):
         dom = book.toc.dom
         topic_map = self._get_topic_map(dom)
-        survey_els = book.document.getElementsByTagName('nasurvey')
-        if survey_els:
-            self._process_surveys(dom, survey_els, topic_map)
+        with extraction_engine(book) as engine, engine.installed():
+            survey_els = engine.getElementsByTagName('nasurvey')
+            if survey_els:
+                self._process_surveys(dom, survey_els, topic_map)
         if savetoc and survey_els:
-            book.toc.save()
+            self._save_toc(book)
+
+    def _save_toc(self, book):
+        if self.defer_toc_save and in_run(book):
+            record_toc_mutation(book)
+        else:
+            save_toc(book.toc)
 
     def _get_topic_map(self, dom):
-        result = {}
-        for topic_el in dom.getElementsByTagName('topic'):
-            ntiid = topic_el.getAttribute('ntiid')
-            if ntiid:
-                result[ntiid] = topic_el
-        return result
-
-    def _parent_finder(self, element, topic_map):
-        lesson_el = None
-        parent_el = element.parentNode
-        while lesson_el is None and parent_el is not None:
-            if hasattr(parent_el, 'ntiid') and parent_el.tagName.startswith('course'):
-                lesson_el = topic_map.get(parent_el.ntiid)
-            parent_el = parent_el.parentNode if lesson_el is None else parent_el
-        return parent_el, lesson_el
-
-    def _process_inquiry(self, dom, element, topic_map):
-        parent_el, lesson_el = self._parent_finder(element, topic_map)
-        if not parent_el or not lesson_el:
+        return get_topic_map(dom)
+
+    def _parent_finder(self, element, topic_map, ancestors=None):
+        ancestors = TOCAncestors(topic_map) if ancestors is None else ancestors
+        return ancestors.lesson(element)
+
+    def _process_inquiry(self, dom, element, topic_map, ancestors=None):
+        parent_el, lesson_el = self._parent_finder(element, topic_map, ancestors)
+        if parent_el is None or lesson_el is None:
             return None
         toc_el = dom.createElement('object')
         toc_el.setAttribute('mimeType', element.mimeType)
         toc_el.setAttribute('target-ntiid', element.ntiid)
-        if lesson_el:
+        if lesson_el is not None:
             lesson_el.appendChild(toc_el)
             lesson_el.appendChild(dom.createTextNode(u'\n'))
         return toc_el
 
     def _process_surveys(self, dom, els, topic_map):
+        ancestors = TOCAncestors(topic_map)
         for element in els:
-            toc_el = self._process_inquiry(dom, element, topic_map)
+            toc_el = self._process_inquiry(dom, element, topic_map, ancestors)
             if not toc_el:
                 continue
             label = title = element.title
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Locating rendered content elements within the table of contents.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+
+from xml.dom import minidom
+
+from xml.parsers.expat import ExpatError
+
+from zope import component
+from zope import interface
+
+from nti.contentrendering.interfaces import IRenderedBook
+
+from nti.contentrendering_assessment.extractors.engine import end_run
+
+from nti.contentrendering_assessment.instrumentation import count
+from nti.contentrendering_assessment.instrumentation import visited
+
+from nti.contentrendering_assessment.interfaces import ITOCSaveExtractor
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The key of the TOC waiting to be saved in the document's ``userdata``
+TOC_PENDING_KEY = 'nti_assessment_toc_pending'
+
+
+def get_topic_map(dom):
+    """
+    Map the NTIID of every ``topic`` in the TOC ``dom`` to its element.
+    """
+    result = {}
+    for topic_el in dom.getElementsByTagName('topic'):
+        ntiid = topic_el.getAttribute('ntiid')
+        if ntiid:
+            result[ntiid] = topic_el
+    return result
+
+
+def is_course_toc(dom):
+    return dom.childNodes[0].getAttribute('isCourse') == u'true'
+
+
+class TOCAncestors(object):
+    """
+    Resolves, for elements of the rendered document, the nearest
+    enclosing ``course*`` node that is a topic of the TOC and the
+    nearest enclosing node with a title.
+
+    Every node is examined at most once: the answer found for a node is
+    remembered for all the nodes walked to reach it, so the elements of
+    a whole book are resolved in time linear in its size.
+    """
+
+    def __init__(self, topic_map):
+        self.topic_map = topic_map
+        #: ``id(node)`` -> ``(node, (course_el, lesson_el))``
+        self._lessons = {}
+        #: ``id(node)`` -> ``(node, title_el)``
+        self._titles = {}
+
+    @staticmethod
+    def _resolve(node, memo, match):
+        """
+        The value of ``match`` for ``node`` or its nearest ancestor for
+        which it is not ``None``.
+        """
+        path = []
+        result = None
+        while node is not None:
+            entry = memo.get(id(node))
+            if entry is not None and entry[0] is node:
+                result = entry[1]
+                break
+            path.append(node)
+            result = match(node)
+            if result is not None:
+                break
+            node = node.parentNode
+        for x in path:
+            memo[id(x)] = (x, result)
+        count('toc_nodes_visited', len(path))
+        visited(len(path))
+        return result
+
+    def _match_lesson(self, node):
+        if hasattr(node, 'ntiid') and node.tagName.startswith('course'):
+            lesson_el = self.topic_map.get(node.ntiid)
+            if lesson_el is not None:
+                return node, lesson_el
+        return None
+
+    @staticmethod
+    def _match_title(node):
+        return node if hasattr(node, 'title') else None
+
+    def lesson(self, element):
+        """
+        Return ``(course_el, lesson_el)``: the closest ancestor of
+        ``element`` that is a course node with a topic in the TOC, and
+        that topic. Both are ``None`` if there is no such ancestor.
+        """
+        result = self._resolve(element.parentNode, self._lessons,
+                               self._match_lesson)
+        return result if result is not None else (None, None)
+
+    def title_element(self, element):
+        """
+        The closest ancestor of ``element`` that has a ``title``.
+        """
+        return self._resolve(element.parentNode, self._titles,
+                             self._match_title)
+
+
+def _serialized_digest(dom):
+    return hashlib.sha1(dom.toxml(encoding='utf-8')).digest()
+
+
+def _file_digest(filename):
+    """
+    The :func:`_serialized_digest` of the document in ``filename``, or
+    ``None`` if it cannot be read.
+    """
+    try:
+        return _serialized_digest(minidom.parse(filename))
+    except (IOError, OSError, ExpatError):
+        return None
+
+
+def save_toc(toc):
+    """
+    Save ``toc`` unless its file already holds the same document,
+    leaving unchanged files (and whatever watches them) alone. Returns
+    whether the file was written.
+
+    Both documents are serialized the same way, in memory, so the
+    comparison does not depend on the declaration or encoding
+    ``toc.save()`` writes.
+    """
+    filename = getattr(toc, 'filename', None)
+    if filename and _file_digest(filename) == _serialized_digest(toc.dom):
+        logger.info("%s is unchanged, not saving", filename)
+        return False
+    toc.save()
+    return True
+
+
+def record_toc_mutation(book):
+    """
+    Note that the TOC of ``book`` was changed and must be saved by
+    :func:`flush_toc` at the end of the extraction run.
+    """
+    book.document.userdata[TOC_PENDING_KEY] = book.toc
+
+
+def flush_toc(book):
+    """
+    Save the TOC of ``book`` if a mutation was recorded. Returns whether
+    the file was written.
+    """
+    toc = book.document.userdata.pop(TOC_PENDING_KEY, None)
+    return save_toc(toc) if toc is not None else False
+
+
+@component.adapter(IRenderedBook)
+@interface.implementer(ITOCSaveExtractor)
+class _TOCSaveExtractor(object):
+    """
+    Runs last: saves the TOC changes the lesson extractors deferred and
+    ends the extraction run begun by ``000.ExtractionRunExtractor``.
+    """
+
+    def __init__(self, book=None):
+        pass
+
+    def transform(self, book, savetoc=True, outpath=None):
+        if savetoc:
+            flush_toc(book)
+        else:
+            book.document.userdata.pop(TOC_PENDING_KEY, None)
+        end_run(book)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental JSON output for the assessment index.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import gzip
+import codecs
+import contextlib
+
+from operator import itemgetter
+
+import simplejson as json
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The suffix of the gzip-compressed copy of an output file
+COMPRESSED_SUFFIX = '.gz'
+
+
+class _CompressingFile(object):
+    """
+    A text file that also writes what it is given, as UTF-8, to a
+    gzip file.
+    """
+
+    def __init__(self, fp, compressed):
+        self.fp = fp
+        self.compressed = compressed
+
+    def write(self, text):
+        self.fp.write(text)
+        self.compressed.write(text.encode('utf-8'))
+
+
+@contextlib.contextmanager
+def output_file(path, compress=False):
+    """
+    Open ``path`` for writing text as UTF-8. The text goes to a file
+    beside ``path`` that replaces it once complete, so a failed build
+    never leaves a truncated file in place; if writing fails, the
+    partial files are removed.
+
+    If ``compress`` is true, a gzip-compressed copy is written to
+    ``path`` plus :data:`COMPRESSED_SUFFIX` in the same pass. The gzip
+    header has neither a file name nor a modification time, so the same
+    text always gives the same bytes. Otherwise, a compressed copy left
+    by an earlier build is removed.
+    """
+    tmp = path + '.tmp'
+    compressed_path = path + COMPRESSED_SUFFIX
+    compressed_tmp = compressed_path + '.tmp'
+    try:
+        with codecs.open(tmp, 'w', encoding='utf-8') as fp:
+            if not compress:
+                yield fp
+            else:
+                with open(compressed_tmp, 'wb') as raw:
+                    with gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                                       fileobj=raw, mtime=0) as compressed:
+                        yield _CompressingFile(fp, compressed)
+        os.rename(tmp, path)
+        if compress:
+            os.rename(compressed_tmp, compressed_path)
+    except BaseException:
+        for name in (tmp, compressed_tmp):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    if not compress and os.path.exists(compressed_path):
+        # Left by an earlier build, it no longer matches ``path``
+        os.remove(compressed_path)
+
+
+class StreamingJSONWriter(object):
+    """
+    Writes a JSON document to ``fp`` a piece at a time, producing the
+    same text as ``simplejson.dump(obj, fp, sort_keys=True, ...)`` would
+    for the equivalent fully-built object.
+
+    Objects are written with :meth:`write_object` from ``(key, value)``
+    pairs. A value may be a callable taking this writer, in which case
+    it is only invoked when its turn comes, so nested objects never need
+    to exist in memory all at once.
+
+    The writer keeps count of the bytes written, as UTF-8, in
+    :attr:`position`, so the location of values in the output can be
+    recorded as they are written.
+    """
+
+    #: The number of bytes written so far
+    position = 0
+
+    def __init__(self, fp, indent='\t', ensure_ascii=True, separators=None):
+        self.fp = fp
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        if separators is None:
+            separators = (',', ': ') if indent is not None else (', ', ': ')
+        self.item_separator, self.key_separator = separators
+        self.depth = 0
+
+    def _dumps(self, value):
+        return json.dumps(value,
+                          indent=self.indent,
+                          sort_keys=True,
+                          separators=(self.item_separator, self.key_separator),
+                          ensure_ascii=self.ensure_ascii)
+
+    def _write(self, text):
+        self.fp.write(text)
+        if self.ensure_ascii:
+            self.position += len(text)
+        else:
+            self.position += len(text.encode('utf-8'))
+
+    def _newline(self):
+        if self.indent is not None:
+            self._write('\n' + self.indent * self.depth)
+
+    def write_value(self, value):
+        if callable(value):
+            value(self)
+            return
+        text = self._dumps(value)
+        if self.indent is not None and self.depth:
+            # Encoded strings never contain a raw newline, so every
+            # newline here starts an indented line.
+            text = text.replace('\n', '\n' + self.indent * self.depth)
+        self._write(text)
+
+    def write_object(self, members, offsets=None):
+        """
+        Write an object of ``members``. If ``offsets`` is given, the
+        ``(offset, length)`` in bytes of the value of each member is
+        stored in it under the member's key.
+        """
+        members = sorted(members, key=itemgetter(0))
+        if not members:
+            self._write('{}')
+            return
+        self._write('{')
+        self.depth += 1
+        for i, (key, value) in enumerate(members):
+            if i:
+                self._write(self.item_separator)
+            self._newline()
+            self._write(self._dumps(key) + self.key_separator)
+            start = self.position
+            self.write_value(value)
+            if offsets is not None:
+                offsets[key] = (start, self.position - start)
+        self.depth -= 1
+        self._newline()
+        self._write('}')
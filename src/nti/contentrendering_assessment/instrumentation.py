@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timers, counters and trace spans for the work done while rendering and
+extracting assessments.
+
+Nothing is recorded unless a :class:`Recorder` is active (see
+:func:`activated`); the extractors activate one for their book when
+their ``instrument`` option (``NTI_ASSESSMENT_INSTRUMENT``) is set, and
+write its report as ``assessment_instrumentation.json`` next to
+``assessment_index.json``.
+
+Timers are inclusive: the time of a question set's ``assessment_object``
+contains that of any question it constructs.
+
+With traversal accounting (see :func:`counting_traversals`, or the
+``traversals`` option of the extractors) the recorder also counts the
+DOM nodes each call site walks through ``getElementsByTagName``,
+``allChildNodes`` and ``parentNode`` loops, and the report lists the
+worst offenders.
+
+The same hooks record spans into an active :class:`Tracer` (see
+:func:`tracing`), written in the Chrome trace-event format that
+``chrome://tracing`` and Perfetto open. Setting
+``NTI_ASSESSMENT_TRACE`` to a file name traces the whole process,
+rendering included, and writes the file when it exits.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import codecs
+import atexit
+import functools
+import threading
+import contextlib
+
+from timeit import default_timer
+
+import simplejson as json
+
+from plasTeX.DOM import Node
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The name of the report written next to ``assessment_index.json``
+SIDECAR_NAME = 'assessment_instrumentation.json'
+
+#: The key of the recorder of a book in its document's ``userdata``
+RECORDER_KEY = 'nti_assessment_recorder'
+
+# CPU time of this process; ``time.clock`` is that on Python 2 POSIX
+_cpu_timer = getattr(time, 'process_time', None) or time.clock
+
+#: The environment variable naming a trace file for the whole process
+TRACE_ENVIRONMENT = 'NTI_ASSESSMENT_TRACE'
+
+_active = []
+
+_tracers = []
+
+# ``(id(node), name)`` of the method calls being measured, so that
+# decorated overrides calling ``super()`` are measured once
+_open = set()
+
+#: The number of call sites listed in ``top_visits``
+TOP_VISITS = 10
+
+# Recorders counting traversals, and whether a counted traversal is
+# in progress (the plasTeX walks recurse through themselves)
+_accounting = []
+_walking = []
+
+# Modules whose frames are not call sites: the accounting itself and
+# the traversal primitives
+_SKIPPED_MODULES = (__name__,
+                    'nti.contentrendering_assessment.tagindex',
+                    'plasTeX.DOM')
+
+_originals = {}
+
+
+class Recorder(object):
+    """
+    Accumulates the calls, wall time and CPU time of named timers and
+    the totals of named counters.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.visits = {}
+
+    def add_time(self, name, wall, cpu):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+        timer['calls'] += 1
+        timer['wall'] += wall
+        timer['cpu'] += cpu
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        wall = default_timer()
+        cpu = _cpu_timer()
+        try:
+            yield
+        finally:
+            self.add_time(name, default_timer() - wall, _cpu_timer() - cpu)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def visit(self, site, n):
+        self.visits[site] = self.visits.get(site, 0) + n
+
+    def top_visits(self, n=TOP_VISITS):
+        """
+        The ``n`` call sites that visited the most nodes, as
+        ``(site, nodes)`` pairs.
+        """
+        ranked = sorted(self.visits.items(), key=lambda x: (-x[1], x[0]))
+        return ranked[:n]
+
+    def report(self):
+        result = {'timers': self.timers, 'counters': self.counters}
+        if self.visits:
+            result['visits'] = self.visits
+            result['top_visits'] = self.top_visits()
+        return result
+
+    def write(self, path):
+        with codecs.open(path, 'w', encoding='utf-8') as fp:
+            json.dump(self.report(), fp, indent='\t', sort_keys=True)
+
+
+class Tracer(object):
+    """
+    Collects complete (``X``) trace events. Times are in microseconds
+    of :func:`timeit.default_timer`.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+
+    def add_span(self, name, start, duration, args=None):
+        event = {'name': name,
+                 'cat': name.partition('.')[0],
+                 'ph': 'X',
+                 'ts': start * 1e6,
+                 'dur': duration * 1e6,
+                 'pid': self.pid,
+                 'tid': threading.current_thread().ident}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def write(self, path):
+        with codecs.open(path, 'w', encoding='utf-8') as fp:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'},
+                      fp)
+
+
+def active_recorder():
+    """
+    The innermost activated :class:`Recorder`, or ``None``.
+    """
+    return _active[-1] if _active else None
+
+
+def active_tracer():
+    """
+    The innermost :class:`Tracer` activated by :func:`tracing`, or
+    ``None``.
+    """
+    return _tracers[-1] if _tracers else None
+
+
+@contextlib.contextmanager
+def activated(recorder):
+    _active.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _active.pop()
+
+
+@contextlib.contextmanager
+def tracing(path=None):
+    """
+    Record spans into a new :class:`Tracer` for the duration of the
+    block, then write them to ``path``, if given.
+    """
+    tracer = Tracer()
+    _tracers.append(tracer)
+    try:
+        yield tracer
+    finally:
+        _tracers.pop()
+        if path:
+            tracer.write(path)
+
+
+@contextlib.contextmanager
+def _measuring(name, args=None):
+    recorder = active_recorder()
+    tracer = active_tracer()
+    if recorder is None and tracer is None:
+        yield
+        return
+    wall = default_timer()
+    cpu = _cpu_timer()
+    try:
+        yield
+    finally:
+        elapsed = default_timer() - wall
+        if recorder is not None:
+            recorder.add_time(name, elapsed, _cpu_timer() - cpu)
+        if tracer is not None:
+            tracer.add_span(name, wall, elapsed, args)
+
+
+def timed(name, **args):
+    """
+    Time the block into the active recorder and tracer, if any. Keyword
+    arguments are attached to the trace span.
+    """
+    return _measuring(name, args)
+
+
+def count(name, n=1):
+    """
+    Add ``n`` to the counter ``name`` of the active recorder, if any.
+    """
+    recorder = active_recorder()
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None \
+            and frame.f_globals.get('__name__', '').startswith(_SKIPPED_MODULES):
+        frame = frame.f_back
+    if frame is None:  # pragma: no cover
+        return '?'
+    return '%s:%s' % (frame.f_globals.get('__name__'), frame.f_code.co_name)
+
+
+def visited(n):
+    """
+    Charge ``n`` visited nodes to the calling function, if traversals
+    are being counted.
+    """
+    if _accounting:
+        _accounting[-1].visit(_call_site(), n)
+
+
+def _all_child_nodes(self):
+    if _walking:
+        return _originals['allChildNodes'].fget(self)
+    _walking.append(True)
+    try:
+        result = _originals['allChildNodes'].fget(self)
+    finally:
+        _walking.pop()
+    visited(len(result))
+    return result
+
+
+def _get_elements_by_tag_name(self, tagName):
+    if _walking:
+        return _originals['getElementsByTagName'](self, tagName)
+    _walking.append(True)
+    try:
+        result = _originals['getElementsByTagName'](self, tagName)
+        size = len(_originals['allChildNodes'].fget(self))
+    finally:
+        _walking.pop()
+    visited(size)
+    return result
+
+
+def _patch_traversals():
+    _originals['allChildNodes'] = Node.__dict__['allChildNodes']
+    _originals['getElementsByTagName'] = Node.__dict__['getElementsByTagName']
+    Node.allChildNodes = property(_all_child_nodes)
+    Node.getElementsByTagName = _get_elements_by_tag_name
+
+
+def _unpatch_traversals():
+    Node.allChildNodes = _originals.pop('allChildNodes')
+    Node.getElementsByTagName = _originals.pop('getElementsByTagName')
+
+
+@contextlib.contextmanager
+def counting_traversals(recorder):
+    """
+    Count the nodes visited by each call site into ``recorder`` for
+    the duration of the block. The plasTeX traversal methods are
+    replaced with counting versions meanwhile, which makes them
+    slower; this is for finding superlinear walks, not for timing.
+    """
+    if not _accounting:
+        _patch_traversals()
+    _accounting.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _accounting.pop()
+        if not _accounting:
+            _unpatch_traversals()
+
+
+def _node_args(node, ntiid):
+    args = {'tag': getattr(node, 'tagName', None)}
+    if ntiid:
+        args['ntiid'] = getattr(node, 'ntiid', None)
+    return args
+
+
+def timed_method(name, ntiid=True):
+    """
+    A decorator timing each call of a method of a DOM node, when a
+    recorder or tracer is active, as ``<name>.<class name>``. Spans
+    carry the tag name of the node and, if ``ntiid`` is true, its NTIID;
+    pass false for methods that run before the NTIID can be computed,
+    such as ``digest``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = (id(self), name)
+            if (not _active and not _tracers) or key in _open:
+                return func(self, *args, **kwargs)
+            _open.add(key)
+            try:
+                with _measuring('%s.%s' % (name, type(self).__name__),
+                                _node_args(self, ntiid)):
+                    return func(self, *args, **kwargs)
+            finally:
+                _open.discard(key)
+        return wrapper
+    return decorator
+
+
+def book_recorder(book):
+    """
+    The :class:`Recorder` shared by the extractors of ``book``, created
+    on first use.
+    """
+    userdata = book.document.userdata
+    recorder = userdata.get(RECORDER_KEY)
+    if recorder is None:
+        recorder = userdata[RECORDER_KEY] = Recorder()
+    return recorder
+
+
+@contextlib.contextmanager
+def _maybe_counting_traversals(recorder, enabled):
+    if not enabled:
+        yield recorder
+        return
+    with counting_traversals(recorder):
+        yield recorder
+
+
+@contextlib.contextmanager
+def instrumenting(book, name, enabled, outpath, traversals=False):
+    """
+    If ``enabled`` or ``traversals``, activate the recorder of ``book``
+    and time the block as ``name``, then write the report to
+    ``outpath``. Each extractor rewrites the report, so after the last
+    it covers the whole run. If ``traversals``, nodes visited are
+    counted too. The block is traced either way.
+    """
+    if not enabled and not traversals:
+        with timed(name):
+            yield None
+        return
+    recorder = book_recorder(book)
+    with activated(recorder), \
+            _maybe_counting_traversals(recorder, traversals):
+        with timed(name):
+            yield recorder
+    for site, nodes in recorder.top_visits():
+        logger.info("%s visited %s nodes", site, nodes)
+    recorder.write(os.path.join(outpath, SIDECAR_NAME))
+
+
+def _trace_from_environment():
+    path = os.environ.get(TRACE_ENVIRONMENT)
+    if path:
+        tracer = Tracer()
+        _tracers.append(tracer)
+        atexit.register(tracer.write, os.path.expanduser(path))
+
+
+_trace_from_environment()
@@ -11,6 +11,12 @@ from __future__ import absolute_import
 from nti.contentrendering.interfaces import IRenderedBookExtractor
 
 
+class IExtractionRunExtractor(IRenderedBookExtractor):
+    """
+    Begins the run of the assessment extractors over a rendered book.
+    """
+
+
 class IAssessmentExtractor(IRenderedBookExtractor):
     """
     Looks through the rendered book and extracts assessment information.
@@ -27,3 +33,10 @@ class ILessonSurveyExtractor(IRenderedBookExtractor):
     """
     Looks through the rendered book and extracts the surveys in a lesson.
     """
+
+
+class ITOCSaveExtractor(IRenderedBookExtractor):
+    """
+    Saves the table of contents changes deferred by the lesson extractors
+    and ends the run of the assessment extractors.
+    """
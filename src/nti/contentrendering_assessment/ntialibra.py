@@ -44,6 +44,9 @@ from nti.contentrendering_assessment.ntibase import _LocalContentMixin
 
 from nti.contentrendering_assessment.ntiquestion import naquestion
 
+from nti.contentrendering_assessment.instrumentation import visited
+from nti.contentrendering_assessment.instrumentation import timed_method
+
 logger = __import__('logging').getLogger(__name__)
 
 # Parts
@@ -144,6 +147,7 @@ class naqfillintheblankwithwordbankpart(_WordBankMixIn, _AbstractNAQPart):
             solutions.append(solution)
         return solutions
 
+    @timed_method('digest', ntiid=False)
     def digest(self, tokens):
         res = super(naqfillintheblankwithwordbankpart, self).digest(tokens)
         if self.macroMode != Base.Environment.MODE_END:
@@ -236,6 +240,7 @@ class naqfillintheblankshortanswerpart(_AbstractNAQPart):
             solutions.append(solution)
         return solutions
 
+    @timed_method('digest', ntiid=False)
     def digest(self, tokens):
         res = super(naqfillintheblankshortanswerpart, self).digest(tokens)
         if self.macroMode != Base.Environment.MODE_END:
@@ -381,13 +386,16 @@ def _remove_parts_after_render(self, _):
 class naquestionfillintheblankwordbank(_WordBankMixIn, naquestion):
 
     def _get_parent(self, element):
+        steps = 1
         try:
             parent = element.parentNode
             while (parent is not None and not isinstance(parent, _WordBankMixIn)):
                 parent = parent.parentNode
+                steps += 1
             result = parent
         except AttributeError:
             result = None
+        visited(steps)
         return result
 
     def _asm_entries(self):
@@ -400,6 +408,7 @@ class naquestionfillintheblankwordbank(_WordBankMixIn, naquestion):
             result = _naqwordbank, entries
         return result
 
+    @timed_method('after_render')
     def _after_render(self, rendered):
         self._asm_local_content = _remove_parts_after_render(self, rendered)
 
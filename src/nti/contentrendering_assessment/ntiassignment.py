@@ -35,6 +35,11 @@ from nti.contentrendering_assessment.ntibase import naassesmentref
 from nti.contentrendering_assessment.ntibase import _AbstractNAQTags
 from nti.contentrendering_assessment.ntibase import _LocalContentMixin
 
+from nti.contentrendering_assessment.instrumentation import visited
+from nti.contentrendering_assessment.instrumentation import timed_method
+
+from nti.contentrendering_assessment.tagindex import getElementsByTagName
+
 from nti.contentrendering_assessment.utils import parse_assessment_datetime
 from nti.contentrendering_assessment.utils import secs_converter as _secs_converter
 
@@ -67,6 +72,7 @@ class naassignmentpart(naassesment,
         pass
 
     @cachedIn(naassesment.cached_attribute)
+    @timed_method('assessment_object')
     def assessment_object(self):
         question_set = self.idref['question_set'].assessment_object()
         auto_grade = self.attributes.get('options', {}).get('auto_grade')
@@ -125,6 +131,7 @@ class naassignment(naassesment,
         return userdata.get('document_timezone_name')
 
     @cachedIn(naassesment.cached_attribute)
+    @timed_method('assessment_object')
     def assessment_object(self):
         local_tzname = self._local_tzname
         options = self.attributes.get('options') or ()
@@ -154,7 +161,7 @@ class naassignment(naassesment,
             maximum_time_allowed = _secs_converter(opt_val)
 
         parts = [part.assessment_object() for part in
-                 self.getElementsByTagName('naassignmentpart')]
+                 getElementsByTagName(self, 'naassignmentpart')]
 
         result = factory(content=self._asm_local_content,
                          available_for_submission_beginning=not_before,
@@ -186,8 +193,11 @@ class naassignment(naassesment,
     @readproperty
     def containerId(self):
         parentNode = self.parentNode
+        steps = 1
         while (not hasattr(parentNode, 'filename')) or (parentNode.filename is None):
             parentNode = parentNode.parentNode
+            steps += 1
+        visited(steps)
         return parentNode.ntiid
 
 
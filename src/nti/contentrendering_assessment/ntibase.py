@@ -32,6 +32,8 @@ from nti.contentrendering.plastexpackages._util import _is_renderable
 from nti.contentrendering.plastexpackages._util import _asm_rendered_textcontent
 from nti.contentrendering.plastexpackages._util import LocalContentMixin as _BaseLocalContentMixin
 
+from nti.contentrendering_assessment.instrumentation import timed_method
+
 from nti.property.property import alias
 
 logger = __import__('logging').getLogger(__name__)
@@ -135,6 +137,7 @@ class _AbstractNonGradableNAQPart(_LocalContentMixin, Base.Environment):
         return result
 
     @cachedIn('_v_assessment_object')
+    @timed_method('assessment_object')
     def assessment_object(self):
         result = self.part_creator()
         errors = schema.getValidationErrors(self._asm_part_interface(), result)
@@ -143,6 +146,11 @@ class _AbstractNonGradableNAQPart(_LocalContentMixin, Base.Environment):
             raise errors[0][1]
         return result
 
+    @timed_method('digest', ntiid=False)
+    def digest(self, tokens):
+        return super(_AbstractNonGradableNAQPart, self).digest(tokens)
+
+    @timed_method('after_render')
     def _after_render(self, rendered):
         super(_AbstractNonGradableNAQPart, self)._after_render(rendered)
         # The hints don't normally get rendered# by the templates, so make sure
@@ -261,6 +269,7 @@ class _AbstractNAQPart(_AbstractNonGradableNAQPart):
             result = super(_AbstractNAQPart, self).part_creator(factory=factory)
         return result
 
+    @timed_method('after_render')
     def _after_render(self, rendered):
         super(_AbstractNAQPart, self)._after_render(rendered)
         # The explanations don't normally get rendere by the templates, so make
@@ -354,3 +363,19 @@ class naassesment(object):
         key = cachedIn._get_cache_key()
         cache[key] = value
         self._set_assessment_object(value)
+
+
+def release_assessment_objects(element):
+    """
+    Forget the assessment objects cached by ``element`` and by the
+    elements (such as parts) below it, so they can be freed; they are
+    built again if asked for. Returns the number released.
+    """
+    attr = naassesment.cached_attribute
+    released = 0
+    nodes = itertools.chain((element,), element.allChildNodes)
+    for node in nodes:
+        if getattr(node, attr, None) is not None:
+            delattr(node, attr)
+            released += 1
+    return released
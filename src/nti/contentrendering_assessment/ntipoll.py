@@ -47,6 +47,11 @@ from nti.contentrendering_assessment.ntibase import naassesmentref
 from nti.contentrendering_assessment.ntibase import _AbstractNAQTags
 from nti.contentrendering_assessment.ntibase import _LocalContentMixin
 
+from nti.contentrendering_assessment.instrumentation import visited
+from nti.contentrendering_assessment.instrumentation import timed_method
+
+from nti.contentrendering_assessment.tagindex import getElementsByTagName
+
 from nti.contentrendering_assessment.utils import parse_assessment_datetime
 
 from nti.property.property import alias
@@ -152,6 +157,7 @@ class napoll(_LocalContentMixin, Base.Environment, nainquiry):
         return result
 
     @cachedIn('_v_assessment_object')
+    @timed_method('assessment_object')
     def assessment_object(self):
         # parse options
         options = self.options
@@ -229,20 +235,11 @@ class nasurvey(Base.List, nainquiry):
             raise errors[0][1]
         return survey
 
-    @cachedIn('_v_assessment_object')
-    def assessment_object(self):
-        # parse options
-        options = self.options
-        disclosure = self.disclosure(options)
-        not_after = self.not_after(options)
-        not_before = self.not_before(options)
-        is_non_public = self.is_non_public(options)
-
-        # parse poll questions
-        questions = [qref.idref['label'].assessment_object()
-                     for qref in self.getElementsByTagName('napollref')]
-        questions = PersistentList(questions)
-
+    def _asm_title(self):
+        """
+        The :attr:`title` as given to the assessment object, rendered if
+        it is inherited from an enclosing section, or ``None``.
+        """
         # Note that we may not actually have a renderer, depending on when
         # in our lifetime this is called (the renderer object mixin is deprecated
         # anyway)
@@ -254,9 +251,24 @@ class nasurvey(Base.List, nainquiry):
                                                        self.title)))
         else:
             title = text_type(getattr(self.title, 'source', self.title))
+        return title.strip() or None
+
+    @cachedIn('_v_assessment_object')
+    @timed_method('assessment_object')
+    def assessment_object(self):
+        # parse options
+        options = self.options
+        disclosure = self.disclosure(options)
+        not_after = self.not_after(options)
+        not_before = self.not_before(options)
+        is_non_public = self.is_non_public(options)
 
-        title = title.strip() or None
+        # parse poll questions
+        questions = [qref.idref['label'].assessment_object()
+                     for qref in getElementsByTagName(self, 'napollref')]
+        questions = PersistentList(questions)
 
+        title = self._asm_title()
         result = self.create_survey(questions=questions,
                                     title=title,
                                     disclosure=disclosure,
@@ -279,8 +291,11 @@ class nasurvey(Base.List, nainquiry):
         title = self.attributes.get('title') or None
         if title is None:
             title_el = self.parentNode
+            steps = 1
             while not hasattr(title_el, 'title'):
                 title_el = title_el.parentNode
+                steps += 1
+            visited(steps)
             title = title_el.title
         assert title is not None
         return title
@@ -49,6 +49,11 @@ from nti.contentrendering_assessment.ntibase import naassesmentref
 from nti.contentrendering_assessment.ntibase import _AbstractNAQTags
 from nti.contentrendering_assessment.ntibase import _LocalContentMixin
 
+from nti.contentrendering_assessment.instrumentation import visited
+from nti.contentrendering_assessment.instrumentation import timed_method
+
+from nti.contentrendering_assessment.tagindex import getElementsByTagName
+
 from nti.property.property import alias
 
 logger = __import__('logging').getLogger(__name__)
@@ -130,6 +135,7 @@ class naquestion(naassesment, _LocalContentMixin, _AbstractNAQTags,
         return result
 
     @cachedIn(naassesment.cached_attribute)
+    @timed_method('assessment_object')
     def assessment_object(self):
         result = self._createQuestion()
         errors = schema.getValidationErrors(IQuestion, result)
@@ -196,12 +202,11 @@ class naquestionset(naassesment, _AbstractNAQTags, Base.List,
             raise errors[0][1]
         return questionset
 
-    @cachedIn(naassesment.cached_attribute)
-    def assessment_object(self):
-        questions = [qref.idref['label'].assessment_object()
-                     for qref in self.getElementsByTagName('naquestionref')]
-        questions = PersistentList(questions)
-
+    def _asm_title(self):
+        """
+        The :attr:`title` as given to the assessment object, rendered if
+        it is inherited from an enclosing section, or ``None``.
+        """
         # Note that we may not actually have a renderer, depending on when
         # in our lifetime this is called (the renderer object mixin is deprecated
         # anyway)
@@ -213,9 +218,16 @@ class naquestionset(naassesment, _AbstractNAQTags, Base.List,
                                                        self.title)))
         else:
             title = text_type(getattr(self.title, 'source', self.title))
+        return title.strip() or None
 
-        title = title.strip() or None
+    @cachedIn(naassesment.cached_attribute)
+    @timed_method('assessment_object')
+    def assessment_object(self):
+        questions = [qref.idref['label'].assessment_object()
+                     for qref in getElementsByTagName(self, 'naquestionref')]
+        questions = PersistentList(questions)
 
+        title = self._asm_title()
         result = self.create_questionset(questions=questions, title=title)
         result.tags = self._asm_tags()  # get tags
         self.validate_questionset(result)  # validate
@@ -235,8 +247,11 @@ class naquestionset(naassesment, _AbstractNAQTags, Base.List,
         if title is None:
             # SAJ: This code path is bad and needs to go away
             title_el = self.parentNode
+            steps = 1
             while not hasattr(title_el, 'title'):
                 title_el = title_el.parentNode
+                steps += 1
+            visited(steps)
             title = title_el.title
         assert title is not None
         return title
@@ -336,6 +351,7 @@ class naquestionbank(naquestionset):
         questionset.validate()
         return questionset
 
+    @timed_method('digest', ntiid=False)
     def digest(self, tokens):
         res = super(naquestionbank, self).digest(tokens)
         if self.macroMode != Base.Environment.MODE_END:
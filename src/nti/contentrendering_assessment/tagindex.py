@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A tag-name index over a rendered plasTeX document.
+
+``getElementsByTagName`` walks the whole subtree of the node it is
+called on. A :class:`TagIndex` is built with a single traversal and then
+answers the same question for any node of the document with two binary
+searches, so repeated lookups across a book cost O(N) in total.
+
+The index describes the tree as it was when built; install it (see
+:func:`tag_index`) only while the document is not being restructured,
+e.g. once rendering is complete.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import contextlib
+
+from bisect import bisect_right
+
+from nti.contentrendering_assessment.instrumentation import visited
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The key of the installed index in the document's ``userdata``
+TAG_INDEX_KEY = 'nti_assessment_tag_index'
+
+
+def _child_nodes(node):
+    return getattr(node, 'childNodes', None) or ()
+
+
+def traverse(root, visitors):
+    """
+    Walk ``root`` and all of its descendants once, in document order.
+    Each of the ``visitors`` has its ``enter(node)`` called before the
+    children of a node are visited and its ``exit(node)`` after.
+    """
+    for visitor in visitors:
+        visitor.enter(root)
+    # Iterative, so that deep documents don't exhaust the stack
+    stack = [iter(_child_nodes(root))]
+    nodes = [root]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            node = nodes.pop()
+            for visitor in visitors:
+                visitor.exit(node)
+            continue
+        for visitor in visitors:
+            visitor.enter(child)
+        stack.append(iter(_child_nodes(child)))
+        nodes.append(child)
+
+
+class TagIndex(object):
+    """
+    Every node below ``root`` numbered in document (pre-)order, with the
+    positions of each tag name and the range of positions spanned by the
+    subtree of each node.
+
+    An index created without a ``root`` is filled in by passing it as
+    one of the visitors of :func:`traverse`.
+    """
+
+    def __init__(self, root=None):
+        self.root = None
+        #: The nodes in document order
+        self._nodes = []
+        #: ``id(node)`` -> ``(start, end)`` positions of its subtree
+        self._ranges = {}
+        #: tag name -> ascending positions of the nodes with that name
+        self._positions = {}
+        self._starts = []
+        if root is not None:
+            traverse(root, (self,))
+
+    def enter(self, node):
+        if self.root is None:
+            self.root = node
+        position = len(self._nodes)
+        self._nodes.append(node)
+        self._positions.setdefault(node.nodeName, []).append(position)
+        self._starts.append(position)
+
+    def exit(self, node):
+        self._ranges[id(node)] = (self._starts.pop(), len(self._nodes) - 1)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def covers(self, node):
+        """
+        Is ``node`` part of the indexed tree?
+        """
+        span = self._ranges.get(id(node))
+        return span is not None and self._nodes[span[0]] is node
+
+    def getElementsByTagName(self, tagName, node=None):
+        """
+        The descendants of ``node`` (default, the root) named ``tagName``
+        in document order, exactly as ``node.getElementsByTagName``
+        would return them.
+        """
+        node = self.root if node is None else node
+        if not self.covers(node):
+            raise KeyError(node)
+        start, end = self._ranges[id(node)]
+        positions = self._positions.get(tagName, ())
+        lo = bisect_right(positions, start)
+        hi = bisect_right(positions, end, lo)
+        return [self._nodes[x] for x in positions[lo:hi]]
+
+
+def _userdata(node):
+    document = getattr(node, 'ownerDocument', None) or node
+    return getattr(document, 'userdata', None)
+
+
+def get_tag_index(node):
+    """
+    The :class:`TagIndex` installed on the document of ``node``, if any.
+    """
+    userdata = _userdata(node)
+    return userdata.get(TAG_INDEX_KEY) if userdata is not None else None
+
+
+def getElementsByTagName(node, tagName):
+    """
+    A replacement for ``node.getElementsByTagName(tagName)`` that uses
+    the installed index of the document when there is one covering
+    ``node``.
+    """
+    index = get_tag_index(node)
+    if index is not None and index.covers(node):
+        result = index.getElementsByTagName(tagName, node)
+        # Only the matches are touched
+        visited(len(result))
+        return result
+    return node.getElementsByTagName(tagName)
+
+
+@contextlib.contextmanager
+def tag_index(document, index=None):
+    """
+    Install a :class:`TagIndex` of ``document`` (``index``, if given)
+    for the duration of the block, reusing one that is already
+    installed.
+    """
+    userdata = document.userdata
+    installed = userdata.get(TAG_INDEX_KEY)
+    if installed is not None:
+        yield installed
+        return
+    if index is None:
+        index = TagIndex(document)
+    userdata[TAG_INDEX_KEY] = index
+    try:
+        yield index
+    finally:
+        userdata.pop(TAG_INDEX_KEY, None)
@@ -0,0 +1,822 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+# disable: accessing protected members, too many methods
+# pylint: disable=W0212,R0904
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import none
+from hamcrest import not_none
+from hamcrest import has_key
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import greater_than
+from hamcrest import same_instance
+
+import os
+import gzip
+import shutil
+import sqlite3
+import weakref
+import tempfile
+import contextlib
+
+import simplejson as json
+
+from xml.dom import minidom
+
+from zope import interface
+
+from nti.assessment.interfaces import QUESTION_SET_MIME_TYPE
+
+from nti.contentrendering.interfaces import IRenderedBook
+
+from nti.contentrendering.resources import ResourceRenderer
+
+from nti.contentrendering_assessment.extractors.assessment import _AssessmentExtractor
+
+from nti.contentrendering_assessment.extractors.canonical import stable
+from nti.contentrendering_assessment.extractors.canonical import content_digest
+
+from nti.contentrendering_assessment.extractors.database import DATABASE_NAME
+
+from nti.contentrendering_assessment.extractors.engine import RUN_KEY
+from nti.contentrendering_assessment.extractors.engine import ENGINE_KEY
+from nti.contentrendering_assessment.extractors.engine import extraction_engine
+from nti.contentrendering_assessment.extractors.engine import _ExtractionRunExtractor
+
+from nti.contentrendering_assessment.extractors.ndjson import NDJSON_NAME
+
+from nti.contentrendering_assessment.extractors.normalized import load_index
+from nti.contentrendering_assessment.extractors.normalized import iter_index_items
+
+from nti.contentrendering_assessment.extractors.offsets import OFFSETS_NAME
+from nti.contentrendering_assessment.extractors.offsets import AssessmentIndexReader
+
+from nti.contentrendering_assessment.extractors.report import REPORT_NAME
+
+from nti.contentrendering_assessment.extractors.shards import SHARDS_DIR
+from nti.contentrendering_assessment.extractors.shards import file_entry
+from nti.contentrendering_assessment.extractors.shards import load_shard
+from nti.contentrendering_assessment.extractors.shards import load_manifest
+
+from nti.contentrendering_assessment.extractors.solutions import SOLUTIONS_NAME
+from nti.contentrendering_assessment.extractors.solutions import strip_solutions
+
+from nti.contentrendering_assessment.extractors.writer import output_file
+
+from nti.contentrendering_assessment.extractors.questionset import _LessonQuestionSetExtractor
+
+from nti.contentrendering_assessment.extractors.toc import save_toc
+from nti.contentrendering_assessment.extractors.toc import flush_toc
+from nti.contentrendering_assessment.extractors.toc import TOCAncestors
+from nti.contentrendering_assessment.extractors.toc import TOC_PENDING_KEY
+from nti.contentrendering_assessment.extractors.toc import _TOCSaveExtractor
+from nti.contentrendering_assessment.extractors.toc import record_toc_mutation
+
+from nti.contentrendering_assessment.instrumentation import SIDECAR_NAME
+
+from nti.contentrendering.RenderedBook import EclipseTOC
+
+from nti.contentrendering.tests import RenderContext
+
+from nti.contentrendering_assessment.tests import _simpleLatexDocument
+from nti.contentrendering_assessment.tests import AssessmentRenderingTestCase
+
+EXAMPLE = r"""
+\chapter{Chapter One}
+
+We have a paragraph.
+
+\section{Section One}
+
+\begin{naquestion}[individual=true]\label{testquestion}
+    Arbitrary content goes here.
+    \begin{naqsymmathpart}
+    Arbitrary content goes here.
+    \begin{naqsolutions}
+        \naqsolution<unit1,unit2> Some solution
+    \end{naqsolutions}
+    \end{naqsymmathpart}
+\end{naquestion}
+
+\begin{naquestionset}\label{testset}
+    \naquestionref{testquestion}
+\end{naquestionset}
+
+\chapter{Chapter Two}
+
+\begin{naquestion}\label{otherquestion}
+    Other content goes here.
+    \begin{naqfreeresponsepart}
+    Free response.
+    \begin{naqsolutions}
+        \naqsolution An answer
+    \end{naqsolutions}
+    \end{naqfreeresponsepart}
+\end{naquestion}
+"""
+
+
+@interface.implementer(IRenderedBook)
+class _MockRenderedBook(object):
+    document = None
+    contentLocation = None
+
+
+@contextlib.contextmanager
+def _rendered_book(example=EXAMPLE):
+    with RenderContext(_simpleLatexDocument((example,))) as ctx:
+        dom = ctx.dom
+        dom.getElementsByTagName('document')[0].filenameoverride = 'index'
+        render = ResourceRenderer.createResourceRenderer('XHTML', None)
+        render.importDirectory(os.path.join(os.path.dirname(__file__), '..'))
+        render.render(dom)
+
+        book = _MockRenderedBook()
+        book.document = dom
+        book.contentLocation = ctx.docdir
+        yield book
+
+
+def _read(book, name='assessment_index.json'):
+    with open(os.path.join(book.contentLocation, name), 'rb') as fp:
+        return fp.read()
+
+
+class TestAssessmentExtractor(AssessmentRenderingTestCase):
+
+    def test_item_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with _rendered_book() as book:
+                extractor = _AssessmentExtractor(cache_dir=cache_dir)
+                extractor.transform(book)
+                assert_that(extractor._cache.hits, is_(0))
+                assert_that(extractor._cache.misses, is_(3))
+                first = _read(book)
+
+                extractor = _AssessmentExtractor(cache_dir=cache_dir)
+                extractor.transform(book)
+                assert_that(extractor._cache.hits, is_(3))
+                assert_that(extractor._cache.misses, is_(0))
+                assert_that(_read(book), is_(first))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_item_cache_inherited_title(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with _rendered_book() as book:
+                _AssessmentExtractor(cache_dir=cache_dir).transform(book)
+
+            # The question set takes its title from its section
+            renamed = EXAMPLE.replace(r'\section{Section One}',
+                                      r'\section{Section Renamed}')
+            with _rendered_book(renamed) as book:
+                extractor = _AssessmentExtractor(cache_dir=cache_dir)
+                index = extractor.transform(book)
+                assert_that(extractor._cache.hits, is_(2))
+                assert_that(extractor._cache.misses, is_(1))
+                questionset = [x for _, x in iter_index_items(index)
+                               if x['MimeType'] == QUESTION_SET_MIME_TYPE][0]
+                assert_that(questionset, has_entry('title', 'Section Renamed'))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_streaming_matches_in_memory(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor().transform(book)
+            expected = _read(book)
+            assert_that(index, is_(not_none()))
+
+            result = _AssessmentExtractor(streaming=True).transform(book)
+            assert_that(result, is_(none()))
+            assert_that(_read(book), is_(expected))
+
+    def test_streaming_holds_one_section_of_items(self):
+        class Items(dict):
+            pass
+
+        built = []
+        held = []
+
+        class Tracking(_AssessmentExtractor):
+            def _section_items(self, section):
+                held.append(len([x for x in built if x() is not None]))
+                result = Items(super(Tracking, self)._section_items(section))
+                built.append(weakref.ref(result))
+                return result
+
+        with _rendered_book() as book:
+            Tracking(streaming=True).transform(book)
+        # The items of a section are dropped before its children's are built
+        assert_that(held, has_length(greater_than(1)))
+        assert_that(set(held), is_({0}))
+
+    def test_externalizes_each_item_once(self):
+        with _rendered_book() as book:
+            extractor = _AssessmentExtractor()
+            extractor.transform(book)
+            assert_that(extractor.externalizations, is_(3))
+
+    def test_verification_policy(self):
+        with _rendered_book() as book:
+            extractor = _AssessmentExtractor(verification='types')
+            index = extractor.transform(book)
+            assert_that(index, has_entry('Metadata',
+                                         has_entry('verification', 'types')))
+            # One question and one question set class
+            assert_that(extractor._verified_types, has_length(2))
+
+            index = _AssessmentExtractor(verification='off').transform(book)
+            assert_that(index, has_entry('Metadata',
+                                         has_entry('verification', 'off')))
+
+            with self.assertRaises(ValueError):
+                _AssessmentExtractor(verification='bogus').transform(book)
+
+    def test_processes_match_serial(self):
+        with _rendered_book() as book:
+            _AssessmentExtractor().transform(book)
+            expected = _read(book)
+
+            extractor = _AssessmentExtractor(processes=2)
+            extractor.transform(book)
+            assert_that(extractor.externalizations, is_(3))
+            assert_that(_read(book), is_(expected))
+
+            _AssessmentExtractor(processes=2, streaming=True).transform(book)
+            assert_that(_read(book), is_(expected))
+
+    def test_processes_raise_original_error(self):
+        class Failing(_AssessmentExtractor):
+            def _finish_item(self, element, int_obj, verify):
+                raise KeyError(element.ntiid)
+
+        with _rendered_book() as book:
+            for processes in (0, 2):
+                with self.assertRaises(KeyError):
+                    Failing(processes=processes).transform(book)
+
+    def test_processes_use_constructed_objects(self):
+        parent = os.getpid()
+
+        class Checking(_AssessmentExtractor):
+            def _should_verify(self, assm_obj):
+                assm_obj._v_constructed_in = os.getpid()
+                return super(Checking, self)._should_verify(assm_obj)
+
+            def _finish_item(self, element, int_obj, verify):
+                if getattr(int_obj, '_v_constructed_in', None) != parent:
+                    raise ValueError("Constructed again", element.ntiid)
+                return super(Checking, self)._finish_item(element, int_obj,
+                                                          verify)
+
+        with _rendered_book() as book:
+            # Every batch is built after the first has been forked for
+            for kwargs in ({}, {'streaming': True}, {'sharded': True}):
+                Checking(processes=2, object_cache_size=0,
+                         **kwargs).transform(book)
+
+    def test_single_traversal(self):
+        with _rendered_book() as book:
+            userdata = book.document.userdata
+            # As the rendering pipeline runs them
+            _ExtractionRunExtractor().transform(book)
+            _AssessmentExtractor().transform(book)
+            engine = userdata[ENGINE_KEY]
+            _AssessmentExtractor(streaming=True).transform(book)
+            with extraction_engine(book) as inner:
+                assert_that(inner, is_(same_instance(engine)))
+            _TOCSaveExtractor().transform(book, savetoc=False)
+            # Released when the run ends
+            assert_that(userdata, is_not(has_key(ENGINE_KEY)))
+            assert_that(userdata, is_not(has_key(RUN_KEY)))
+
+            # On its own, by the extractor that built it
+            _AssessmentExtractor().transform(book)
+            assert_that(userdata, is_not(has_key(ENGINE_KEY)))
+            with extraction_engine(book) as outer:
+                _AssessmentExtractor().transform(book)
+                assert_that(userdata[ENGINE_KEY], is_(same_instance(outer)))
+            assert_that(userdata, is_not(has_key(ENGINE_KEY)))
+
+            document = book.document.getElementsByTagName('document')[0]
+            section = engine.index_section
+            assert_that(section.element, is_(same_instance(document)))
+            assert_that(engine.getElementsByTagName('naquestion'),
+                        has_length(2))
+
+    def test_instrument(self):
+        with _rendered_book() as book:
+            _AssessmentExtractor(instrument=True).transform(book)
+            report = json.loads(_read(book, SIDECAR_NAME))
+            timers = report['timers']
+            for name in ('transform.AssessmentExtractor', 'engine',
+                         'build_index', 'json_dump',
+                         'ensure_roundtrips._AssessmentExtractor'):
+                assert_that(timers, has_key(name))
+            # Each element constructs its object once
+            assert_that(timers['assessment_object.naquestion'],
+                        has_entry('calls', 2))
+            assert_that(timers['assessment_object.naquestionset'],
+                        has_entry('calls', 1))
+            counters = report['counters']
+            assert_that(counters, has_entry('items', 3))
+            assert_that(counters, has_entry('externalizations', 3))
+            assert_that(counters['dom_nodes_visited'], greater_than(0))
+
+    def test_item_report(self):
+        with _rendered_book() as book:
+            _AssessmentExtractor(item_report=True, item_report_top=2).transform(book)
+            report = json.loads(_read(book, REPORT_NAME))
+            assert_that(report['items'], has_length(3))
+            assert_that(report['heaviest'], has_length(2))
+            assert_that(report['violations'], has_length(0))
+            for entry in report['items'].values():
+                assert_that(entry['bytes'], greater_than(0))
+                assert_that(entry['parts'], is_(1))
+                assert_that(entry['seconds'], is_not(none()))
+
+            # Budgets apply without a report being written
+            extractor = _AssessmentExtractor(item_max_bytes=1)
+            extractor.transform(book)
+            assert_that(extractor._report.violations({'bytes': 1}),
+                        has_length(3))
+
+            with self.assertRaises(ValueError):
+                _AssessmentExtractor(item_max_bytes=1,
+                                     item_budget_action='fail').transform(book)
+
+            # Sizes are those of the items as written
+            index = _AssessmentExtractor(item_report=True, minified=True,
+                                         split_solutions=True,
+                                         digests=True).transform(book)
+            report = json.loads(_read(book, REPORT_NAME))
+            for ntiid, item in iter_index_items(index):
+                written = json.dumps(item, sort_keys=True, ensure_ascii=True,
+                                     separators=(',', ':'))
+                assert_that(report['items'][ntiid]['bytes'], is_(len(written)))
+
+    def test_object_cache_size(self):
+        with _rendered_book() as book:
+            _AssessmentExtractor().transform(book)
+            expected = _read(book)
+            questions = book.document.getElementsByTagName('naquestion')
+            for question in questions:
+                assert_that(question.__dict__, has_key('_v_assessment_object'))
+
+            _AssessmentExtractor(object_cache_size=0).transform(book)
+            assert_that(_read(book), is_(expected))
+            # Including the question the set rebuilt after it was released
+            for question in questions:
+                assert_that(question.__dict__,
+                            is_not(has_key('_v_assessment_object')))
+                part = question.getElementsByTagName('naqsymmathpart') \
+                    or question.getElementsByTagName('naqfreeresponsepart')
+                assert_that(part[0].__dict__,
+                            is_not(has_key('_v_assessment_object')))
+
+            # The most recently externalized item stays cached
+            _AssessmentExtractor(object_cache_size=1).transform(book)
+            elements = list(questions)
+            elements.extend(book.document.getElementsByTagName('naquestionset'))
+            cached = [x for x in elements if '_v_assessment_object' in x.__dict__]
+            assert_that(cached, has_length(1))
+
+    def test_normalized_index(self):
+        with _rendered_book() as book:
+            _AssessmentExtractor().transform(book)
+            nested = json.loads(_read(book))
+            # The default format is not recorded
+            assert_that(_AssessmentExtractor.index_format, is_('nested'))
+            assert_that(nested['Metadata'], is_({'verification': 'full'}))
+
+            index = _AssessmentExtractor(index_format='normalized').transform(book)
+            assert_that(index['Metadata'], has_entry('format', 'normalized'))
+            items = dict(iter_index_items(index))
+            assert_that(items, has_length(3))
+            question, questionset = None, None
+            for ntiid, item in items.items():
+                if 'questions' in item:
+                    questionset = item
+                elif 'testquestion' in ntiid:
+                    question = ntiid
+            assert_that(questionset['questions'],
+                        is_([{'Class': 'AssessmentItemRef',
+                              'Target-NTIID': question}]))
+
+            # Streaming writes the same text
+            normalized = _read(book)
+            _AssessmentExtractor(index_format='normalized',
+                                 streaming=True).transform(book)
+            assert_that(_read(book), is_(normalized))
+
+            path = os.path.join(book.contentLocation, 'assessment_index.json')
+            assert_that(load_index(path), is_(nested))
+
+            with self.assertRaises(ValueError):
+                _AssessmentExtractor(index_format='bogus').transform(book)
+
+    def test_split_solutions(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor(split_solutions=True).transform(book)
+            assert_that(index['Metadata'],
+                        has_entry('solutions_file', SOLUTIONS_NAME))
+            items = dict(iter_index_items(index))
+            for item in items.values():
+                for part in item.get('parts', ()):
+                    assert_that(part, is_not(has_key('solutions')))
+                    assert_that(part, is_not(has_key('explanation')))
+            questionset = [x for x in items.values() if 'questions' in x][0]
+            assert_that(questionset['questions'][0]['parts'][0],
+                        is_not(has_key('solutions')))
+
+            solutions = json.loads(_read(book, SOLUTIONS_NAME))['Items']
+            questions = [k for k, v in items.items() if 'questions' not in v]
+            assert_that(sorted(solutions), is_(sorted(questions)))
+            for answers in solutions.values():
+                assert_that(answers['parts'], has_length(1))
+                assert_that(answers['parts'][0]['solutions'], has_length(1))
+
+            # Streaming writes the same files
+            lean = _read(book)
+            answers = _read(book, SOLUTIONS_NAME)
+            _AssessmentExtractor(split_solutions=True, streaming=True).transform(book)
+            assert_that(_read(book), is_(lean))
+            assert_that(_read(book, SOLUTIONS_NAME), is_(answers))
+
+            # Not splitting them removes the earlier file
+            index = _AssessmentExtractor().transform(book)
+            assert_that(index['Metadata'], is_not(has_key('solutions_file')))
+            assert_that(os.path.exists(os.path.join(book.contentLocation,
+                                                    SOLUTIONS_NAME)),
+                        is_(False))
+
+    def test_strip_solutions(self):
+        part = {'Class': 'FreeResponsePart', 'solutions': ['a'],
+                'explanation': 'because'}
+        item = {'NTIID': 'tag:question', 'parts': [part],
+                # Keys of the same name elsewhere are kept
+                'explanation': 'content', 'tags': {'solutions': 1}}
+        solutions = {}
+        result = strip_solutions(item, solutions)
+        assert_that(result, is_({'NTIID': 'tag:question',
+                                 'parts': [{'Class': 'FreeResponsePart'}],
+                                 'explanation': 'content',
+                                 'tags': {'solutions': 1}}))
+        assert_that(solutions, is_({'tag:question': {'parts': [
+            {'solutions': ['a'], 'explanation': 'because'}]}}))
+        assert_that(part, has_key('solutions'))
+
+    def test_sharded(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor().transform(book)
+
+            result = _AssessmentExtractor(sharded=True).transform(book)
+            assert_that(result, is_(none()))
+            # The index of the earlier build is removed
+            assert_that(os.path.exists(os.path.join(book.contentLocation,
+                                                    'assessment_index.json')),
+                        is_(False))
+
+            directory = os.path.join(book.contentLocation, SHARDS_DIR)
+            manifest = load_manifest(directory)
+            # One shard per chapter, and one for the book
+            assert_that(manifest['Shards'], has_length(3))
+            for ntiid in index['Items']:
+                assert_that(manifest['Sections'], has_key(ntiid))
+            for name, entry in manifest['Shards'].items():
+                assert_that(file_entry(os.path.join(directory, name)),
+                            is_({'sha256': entry['sha256'],
+                                 'size': entry['size']}))
+
+            items = dict(iter_index_items(index))
+            assert_that(sorted(manifest['AssessmentItems']), is_(sorted(items)))
+            for ntiid, item in items.items():
+                shard = load_shard(directory, ntiid, manifest)
+                assert_that(dict(iter_index_items(shard)), has_entry(ntiid, item))
+
+            # A later build that is not sharded removes the shards
+            _AssessmentExtractor().transform(book)
+            assert_that(os.path.exists(directory), is_(False))
+            assert_that(json.loads(_read(book))['Items'], is_(index['Items']))
+
+    def test_offsets(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor().transform(book)
+            expected = _read(book)
+            path = os.path.join(book.contentLocation, 'assessment_index.json')
+
+            for kwargs in ({}, {'streaming': True}):
+                _AssessmentExtractor(offsets=True, **kwargs).transform(book)
+                assert_that(_read(book), is_(expected))
+                with AssessmentIndexReader(path) as reader:
+                    # Sections as well as items
+                    assert_that(len(reader), greater_than(3))
+                    for ntiid, item in iter_index_items(index):
+                        assert_that(reader[ntiid], is_(item))
+                    for ntiid, entry in index['Items'].items():
+                        assert_that(reader[ntiid], is_(entry))
+                    assert_that(reader.get('missing'), is_(none()))
+
+            # Removed by a build without them, and not available sharded
+            offsets = os.path.join(book.contentLocation, OFFSETS_NAME)
+            _AssessmentExtractor().transform(book)
+            assert_that(os.path.exists(offsets), is_(False))
+            with self.assertRaises(ValueError):
+                _AssessmentExtractor(offsets=True, sharded=True).transform(book)
+
+    def test_sqlite(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor(sqlite=True).transform(book)
+            path = os.path.join(book.contentLocation, DATABASE_NAME)
+            connection = sqlite3.connect(path)
+            try:
+                rows = connection.execute(
+                    "SELECT ntiid, mimetype, json FROM items").fetchall()
+                sections = dict(connection.execute(
+                    "SELECT ntiid, parent FROM sections").fetchall())
+                sets = connection.execute(
+                    "SELECT ntiid FROM items WHERE mimetype = ?",
+                    (QUESTION_SET_MIME_TYPE,)).fetchall()
+            finally:
+                connection.close()
+
+            items = dict(iter_index_items(index))
+            assert_that(rows, has_length(3))
+            for ntiid, mimetype, text in rows:
+                assert_that(json.loads(text), is_(items[ntiid]))
+                assert_that(mimetype, is_(items[ntiid]['MimeType']))
+            assert_that(sets, has_length(1))
+            assert_that(sections, has_length(greater_than(0)))
+            for parent in sections.values():
+                if parent is not None:
+                    assert_that(sections, has_key(parent))
+
+    def test_ndjson(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor(ndjson=True).transform(book)
+            lines = _read(book, NDJSON_NAME).decode('utf-8').splitlines()
+            assert_that(lines, has_length(3))
+
+            items = dict(iter_index_items(index))
+            for line in lines:
+                entry = json.loads(line)
+                assert_that(entry['Item'], is_(items[entry['NTIID']]))
+                assert_that(entry['Section'], is_(not_none()))
+                assert_that(entry, has_key('filename'))
+                assert_that(entry, has_key('href'))
+
+            _AssessmentExtractor(ndjson=True, streaming=True).transform(book)
+            assert_that(sorted(_read(book, NDJSON_NAME).decode('utf-8').splitlines()),
+                        is_(sorted(lines)))
+
+    def test_minified_precompressed(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor().transform(book)
+            pretty = _read(book)
+
+            for kwargs in ({}, {'streaming': True}):
+                _AssessmentExtractor(minified=True, precompressed=True,
+                                     **kwargs).transform(book)
+                minified = _read(book)
+                assert_that(len(minified), is_not(greater_than(len(pretty))))
+                assert_that(b'\n' in minified, is_(False))
+                assert_that(stable(json.loads(minified)), is_(stable(index)))
+
+                compressed = _read(book, 'assessment_index.json.gz')
+                path = os.path.join(book.contentLocation, 'assessment_index.json.gz')
+                with gzip.open(path, 'rb') as fp:
+                    assert_that(fp.read(), is_(minified))
+
+                # The same bytes every time
+                _AssessmentExtractor(minified=True, precompressed=True,
+                                     **kwargs).transform(book)
+                assert_that(_read(book), is_(minified))
+                assert_that(_read(book, 'assessment_index.json.gz'),
+                            is_(compressed))
+
+    def test_digests(self):
+        with _rendered_book() as book:
+            index = _AssessmentExtractor(digests=True).transform(book)
+            root = index['Metadata']['ContentDigest']
+            for _, item in iter_index_items(index):
+                assert_that(item['ContentDigest'], is_(content_digest(item)))
+                item = dict(item)
+                digest = item.pop('ContentDigest')
+                assert_that(digest, is_(content_digest(item)))
+
+            # The same in every output mode
+            _AssessmentExtractor(digests=True, streaming=True).transform(book)
+            streamed = json.loads(_read(book))
+            assert_that(streamed['Metadata'], has_entry('ContentDigest', root))
+
+            _AssessmentExtractor(digests=True, sharded=True).transform(book)
+            manifest = load_manifest(os.path.join(book.contentLocation, SHARDS_DIR))
+            assert_that(manifest['Metadata'], has_entry('ContentDigest', root))
+
+            # and only there when asked for
+            index = _AssessmentExtractor().transform(book)
+            assert_that(index['Metadata'], is_not(has_key('ContentDigest')))
+
+    def test_digests_are_stable(self):
+        def build():
+            with _rendered_book() as book:
+                index = _AssessmentExtractor(digests=True,
+                                             sqlite=True).transform(book)
+                path = os.path.join(book.contentLocation, DATABASE_NAME)
+                connection = sqlite3.connect(path)
+                try:
+                    rows = connection.execute(
+                        "SELECT ntiid, digest FROM items").fetchall()
+                finally:
+                    connection.close()
+            digests = {ntiid: item['ContentDigest']
+                       for ntiid, item in iter_index_items(index)}
+            return index['Metadata']['ContentDigest'], digests, dict(rows)
+
+        # Rendered separately, the items get new times
+        first = build()
+        assert_that(build(), is_(first))
+        # The database has the digests of the index
+        assert_that(first[2], is_(first[1]))
+
+
+    def test_minified_precompressed_are_reproducible(self):
+        def build(**kwargs):
+            with _rendered_book() as book:
+                _AssessmentExtractor(minified=True, precompressed=True,
+                                     **kwargs).transform(book)
+                return _read(book), _read(book, 'assessment_index.json.gz')
+
+        # Rendered separately, the items get new times
+        for kwargs in ({}, {'streaming': True}):
+            first = build(**kwargs)
+            assert_that(build(**kwargs), is_(first))
+            for _, item in iter_index_items(json.loads(first[0])):
+                assert_that(item, has_entry('CreatedTime', 0))
+
+        os.environ['SOURCE_DATE_EPOCH'] = '1500000000'
+        try:
+            index = json.loads(build()[0])
+        finally:
+            del os.environ['SOURCE_DATE_EPOCH']
+        for _, item in iter_index_items(index):
+            assert_that(item, has_entry('CreatedTime', 1500000000))
+
+
+class TestOutputFile(AssessmentRenderingTestCase):
+
+    def test_failure_removes_partial_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'index.json')
+            with output_file(path) as fp:
+                fp.write('{}')
+            for compress in (False, True):
+                with self.assertRaises(ValueError):
+                    with output_file(path, compress) as fp:
+                        fp.write('{"partial"')
+                        raise ValueError()
+                # The earlier file is untouched, and nothing else is left
+                with open(path, 'rb') as fp:
+                    assert_that(fp.read(), is_(b'{}'))
+                assert_that(os.listdir(tmpdir), is_(['index.json']))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_uncompressed_removes_stale_copy(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'index.json')
+            with output_file(path, True) as fp:
+                fp.write('{}')
+            assert_that(os.path.exists(path + '.gz'), is_(True))
+            with output_file(path) as fp:
+                fp.write('[]')
+            assert_that(os.listdir(tmpdir), is_(['index.json']))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestTOCAncestors(AssessmentRenderingTestCase):
+
+    def test_ancestors(self):
+        with _rendered_book() as book:
+            dom = book.document
+            ancestors = TOCAncestors({})
+            for tag_name in ('naquestion', 'naquestionset'):
+                for element in dom.getElementsByTagName(tag_name):
+                    title_el = element.parentNode
+                    while not hasattr(title_el, 'title'):
+                        title_el = title_el.parentNode
+                    assert_that(ancestors.title_element(element),
+                                is_(same_instance(title_el)))
+                    # Not in a course
+                    assert_that(ancestors.lesson(element), is_((None, None)))
+
+
+class _MockTOC(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dom = minidom.parseString('<toc><topic ntiid="tag:a"/></toc>')
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
+        with open(self.filename, 'wb') as fp:
+            fp.write(self.dom.toxml(encoding='utf-8'))
+
+
+class TestTOCSave(AssessmentRenderingTestCase):
+
+    def test_save_toc(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'eclipse-toc.xml')
+            toc = _MockTOC(path)
+            assert_that(save_toc(toc), is_(True))
+            inode = os.stat(path).st_ino
+            # Nothing changed, and nothing was written
+            assert_that(save_toc(toc), is_(False))
+            assert_that(toc.saves, is_(1))
+            assert_that(os.stat(path).st_ino, is_(inode))
+            assert_that(os.listdir(tmpdir), is_(['eclipse-toc.xml']))
+
+            toc.dom.documentElement.setAttribute('isCourse', 'true')
+            assert_that(save_toc(toc), is_(True))
+            assert_that(toc.saves, is_(2))
+            with open(path, 'rb') as fp:
+                assert_that(fp.read(), is_(toc.dom.toxml(encoding='utf-8')))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_save_eclipse_toc(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'eclipse-toc.xml')
+            with open(path, 'wb') as fp:
+                fp.write(b'<?xml version="1.0" encoding="utf-8"?>\n'
+                         b'<toc><topic label="Caf\xc3\xa9" ntiid="tag:a"/></toc>')
+            toc = EclipseTOC(path)
+            toc.save()
+            # Written by the TOC itself
+            assert_that(save_toc(toc), is_(False))
+
+            topic = toc.dom.getElementsByTagName('topic')[0]
+            topic.setAttribute('suppressed', 'true')
+            assert_that(save_toc(toc), is_(True))
+            assert_that(save_toc(toc), is_(False))
+            assert_that(EclipseTOC(path).dom.getElementsByTagName('topic')[0]
+                        .getAttribute('suppressed'), is_('true'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_deferred(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with _rendered_book() as book:
+                book.toc = _MockTOC(os.path.join(tmpdir, 'eclipse-toc.xml'))
+                assert_that(flush_toc(book), is_(False))
+                # Recorded twice, saved once
+                record_toc_mutation(book)
+                record_toc_mutation(book)
+                assert_that(flush_toc(book), is_(True))
+                assert_that(flush_toc(book), is_(False))
+                assert_that(book.toc.saves, is_(1))
+                assert_that(os.path.getsize(book.toc.filename), is_not(0))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lesson_extractors_defer_in_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with _rendered_book() as book:
+                book.toc = _MockTOC(os.path.join(tmpdir, 'eclipse-toc.xml'))
+                # On its own, the extractor saves the TOC itself
+                _LessonQuestionSetExtractor().transform(book)
+                assert_that(book.toc.saves, is_(1))
+                assert_that(book.document.userdata, is_not(has_key(TOC_PENDING_KEY)))
+
+                # Within a run, the end of the run saves it
+                book.toc.dom.documentElement.setAttribute('isCourse', 'false')
+                _ExtractionRunExtractor().transform(book)
+                _LessonQuestionSetExtractor().transform(book)
+                assert_that(book.toc.saves, is_(1))
+                _TOCSaveExtractor().transform(book)
+                assert_that(book.toc.saves, is_(2))
+
+                _ExtractionRunExtractor().transform(book)
+                book.toc.dom.documentElement.setAttribute('isCourse', 'true')
+                _LessonQuestionSetExtractor(defer_toc_save=False).transform(book)
+                assert_that(book.toc.saves, is_(3))
+                _TOCSaveExtractor().transform(book)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import, division
+
+# disable: accessing protected members, too many methods
+# pylint: disable=W0212,R0904
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import any_of
+from hamcrest import has_key
+from hamcrest import has_item
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import instance_of
+from hamcrest import has_entries
+from hamcrest import contains_string
+
+import os
+import shutil
+import tempfile
+
+import simplejson as json
+
+from nti.contentrendering_assessment.extractors.assessment import _AssessmentExtractor
+
+from plasTeX.DOM import Node
+
+from nti.contentrendering_assessment.instrumentation import timed
+from nti.contentrendering_assessment.instrumentation import tracing
+from nti.contentrendering_assessment.instrumentation import Recorder
+from nti.contentrendering_assessment.instrumentation import active_tracer
+from nti.contentrendering_assessment.instrumentation import counting_traversals
+
+from nti.contentrendering.tests import buildDomFromString as _buildDomFromString
+
+from nti.contentrendering_assessment.tests import _simpleLatexDocument
+
+from nti.contentrendering_assessment.tests import AssessmentRenderingTestCase
+
+from nti.contentrendering_assessment.tests.test_extractors import EXAMPLE
+from nti.contentrendering_assessment.tests.test_extractors import _rendered_book
+
+NUMBER = any_of(instance_of(int), instance_of(float))
+
+
+class TestTracing(AssessmentRenderingTestCase):
+
+    def test_trace_events(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'trace.json')
+            with tracing(path):
+                with _rendered_book() as book:
+                    _AssessmentExtractor().transform(book)
+            assert_that(active_tracer(), is_(none()))
+
+            with open(path) as fp:
+                trace = json.load(fp)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        events = trace['traceEvents']
+        for event in events:
+            assert_that(event, has_entries('ph', 'X', 'ts', NUMBER, 'dur', NUMBER))
+        by_name = {}
+        for event in events:
+            by_name.setdefault(event['name'], []).append(event)
+
+        for name in ('digest.naqsymmathpart', 'after_render.naqsymmathpart',
+                     'transform.AssessmentExtractor', 'build_index'):
+            assert_that(by_name, has_key(name))
+
+        # Overrides calling super() are one span
+        assert_that(by_name['after_render.naqsymmathpart'], has_length(1))
+
+        spans = by_name['assessment_object.naquestion']
+        assert_that(spans, has_length(2))
+        assert_that(spans,
+                    has_item(has_entry('args', has_entries(
+                        'tag', 'naquestion',
+                        'ntiid', contains_string('testquestion')))))
+        assert_that(by_name['digest.naqsymmathpart'][0]['args'],
+                    is_({'tag': 'naqsymmathpart'}))
+
+    def test_timed(self):
+        # A no-op without a recorder or tracer
+        with timed('nothing'):
+            pass
+        with tracing() as tracer:
+            with timed('something', ntiid='x'):
+                pass
+        assert_that(tracer.events, has_length(1))
+        assert_that(tracer.events[0], has_entries('name', 'something',
+                                                  'cat', 'something',
+                                                  'args', {'ntiid': 'x'}))
+
+
+class TestTraversals(AssessmentRenderingTestCase):
+
+    def test_counting_traversals(self):
+        dom = _buildDomFromString(_simpleLatexDocument((EXAMPLE,)))
+        size = len(dom.allChildNodes)
+        original = Node.__dict__['getElementsByTagName']
+
+        recorder = Recorder()
+        with counting_traversals(recorder):
+            questions = dom.getElementsByTagName('naquestion')
+            questions[0].assessment_object()
+        assert_that(Node.__dict__['getElementsByTagName'], is_(original))
+
+        site = __name__ + ':test_counting_traversals'
+        assert_that(recorder.visits, has_entry(site, size))
+        assert_that(recorder.top_visits(1), is_([(site, size)]))
+        # Walks made by the question are charged to its own methods
+        assert_that(recorder.visits,
+                    has_key('nti.contentrendering_assessment.ntiquestion:'
+                            '_asm_question_parts'))
+        assert_that(recorder.report(), has_key('top_visits'))
@@ -239,6 +239,7 @@ class TestRenderables(AssessmentRenderingTestCase):
                    'NTIID': 'tag:nextthought.com,2011-10:testing-HTML-temp.0',
                    'filename': 'index.html',
                    'href': 'index.html'}},
+                 'Metadata': {'verification': 'full'},
                  'href': 'index.html'}
             remove_keys(obj, 'ID', 'Signatures', 'CreatedTime', 'Last Modified',
                         'version', 'tags', 'publishLastModified')
@@ -316,6 +317,7 @@ class TestRenderables(AssessmentRenderingTestCase):
                                           'filename': 'index.html',
                                           'href': 'index.html'}
                                           },
+                            'Metadata': {'verification': 'full'},
                             'href': 'index.html'}
             remove_keys(obj, 'CreatedTime', 'Last Modified', 'version',
                         'tags', 'publishLastModified')
@@ -443,6 +445,7 @@ class TestRenderables(AssessmentRenderingTestCase):
                            'NTIID': 'tag:nextthought.com,2011-10:testing-HTML-temp.0',
                            'filename': 'index.html',
                            'href': 'index.html'}},
+                         'Metadata': {'verification': 'full'},
                          'href': 'index.html'}
 
             remove_keys(obj, 'ID', 'CreatedTime', 'Last Modified',
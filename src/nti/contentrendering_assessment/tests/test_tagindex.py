@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import, division
+
+# disable: accessing protected members, too many methods
+# pylint: disable=W0212,R0904
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import same_instance
+
+from nti.contentrendering_assessment.tagindex import TagIndex
+from nti.contentrendering_assessment.tagindex import tag_index
+from nti.contentrendering_assessment.tagindex import get_tag_index
+from nti.contentrendering_assessment.tagindex import getElementsByTagName
+
+from nti.contentrendering.tests import buildDomFromString as _buildDomFromString
+
+from nti.contentrendering_assessment.tests import _simpleLatexDocument
+from nti.contentrendering_assessment.tests import AssessmentRenderingTestCase
+
+from nti.contentrendering_assessment.tests.test_extractors import EXAMPLE
+
+TAG_NAMES = ('naquestion', 'naquestionset', 'naquestionref', 'naqsolution',
+             'naqsymmathpart', 'chapter', 'section', 'par', 'bogus')
+
+
+class TestTagIndex(AssessmentRenderingTestCase):
+
+    def test_matches_getElementsByTagName(self):
+        dom = _buildDomFromString(_simpleLatexDocument((EXAMPLE,)))
+        index = TagIndex(dom)
+        nodes = [dom] + list(dom.allChildNodes)
+        assert_that(index, has_length(len(nodes)))
+        for node in nodes:
+            for name in TAG_NAMES:
+                expected = node.getElementsByTagName(name)
+                found = index.getElementsByTagName(name, node)
+                assert_that(found, has_length(len(expected)))
+                for x, y in zip(found, expected):
+                    assert_that(x, is_(same_instance(y)))
+
+    def test_installed(self):
+        dom = _buildDomFromString(_simpleLatexDocument((EXAMPLE,)))
+        naq = dom.getElementsByTagName('naquestionset')[0]
+        with tag_index(dom) as index:
+            assert_that(get_tag_index(naq), is_(same_instance(index)))
+            with tag_index(dom) as nested:
+                assert_that(nested, is_(same_instance(index)))
+            assert_that(getElementsByTagName(naq, 'naquestionref'),
+                        has_length(1))
+        assert_that(get_tag_index(naq), is_(none()))
+        assert_that(getElementsByTagName(naq, 'naquestionref'),
+                    has_length(1))
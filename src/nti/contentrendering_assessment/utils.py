@@ -8,6 +8,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import os
+
 from nti.contentrendering_assessment.ntibase import aspveint
 
 from nti.externalization.datetime import datetime_from_string
@@ -38,3 +40,22 @@ def parse_assessment_datetime(key, options, default_time, local_tzname=None):
                                   local_tzname=local_tzname)
         return dt
     return None
+
+
+def apply_options(context, options, kwargs, prefix='NTI_ASSESSMENT_'):
+    """
+    Set the named ``options`` on ``context``, taking each value from
+    ``kwargs`` or, failing that, from the ``<prefix><NAME>`` environment
+    variable. ``options`` maps option names to a converter applied to the
+    environment string (``None`` keeps the string as-is).
+    """
+    for name, converter in options.items():
+        value = kwargs.pop(name, None)
+        if value is None:
+            value = os.environ.get(prefix + name.upper())
+            if value is not None and converter is not None:
+                value = converter(value)
+        if value is not None:
+            setattr(context, name, value)
+    if kwargs:
+        raise TypeError("Unexpected options", sorted(kwargs))